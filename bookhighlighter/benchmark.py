@@ -0,0 +1,162 @@
+# poetry run python benchmark.py detectors
+# poetry run python benchmark.py presets
+import argparse
+import glob
+import os
+import sys
+import time
+
+import numpy as np
+import cv2 as cv
+from loguru import logger
+
+from page_detection import PAGE_DETECTORS, PageTracker, create_page_detector
+from presets import PRESETS, load_settings
+
+
+def run_detector(video_file_path, detector_name, scale=0.2):
+    """Run one page detector over a video the same way the main loop does, and time it.
+
+    Args:
+        video_file_path (str): the video to read
+        detector_name (str): one of PAGE_DETECTORS
+        scale (float): the resize factor applied before detection. Defaults to 0.2.
+
+    Returns:
+        dict: frame count, detector time per frame, and the frames where a new page was found
+    """
+    cap = cv.VideoCapture(video_file_path)
+    detector = create_page_detector(detector_name, video_file_path)
+    page_tracker = PageTracker()
+    scores = []
+    page_frames = []
+    detector_seconds = 0
+    while cap.isOpened():
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frame_number = int(cap.get(cv.CAP_PROP_POS_FRAMES))
+        grey_image = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+        small_image = cv.resize(grey_image, (0, 0), fx=scale, fy=scale)
+        start = time.perf_counter()
+        score = detector.update(small_image)
+        detector_seconds += time.perf_counter() - start
+        scores.append(score)
+        if page_tracker.update(score):
+            page_frames.append(frame_number)
+    detector.close()
+    cap.release()
+    frames = len(scores)
+    return {
+        "frames": frames,
+        "ms_per_frame": 1000 * detector_seconds / max(frames, 1),
+        "page_frames": page_frames,
+        "scores": np.array(scores),
+    }
+
+
+def matched_pages(page_frames, reference_frames, tolerance):
+    """Count the pages in page_frames that are within tolerance frames of a reference page"""
+    return sum(
+        any(abs(frame - ref) <= tolerance for ref in reference_frames)
+        for frame in page_frames
+    )
+
+
+def benchmark_detectors(video_files, detectors, tolerance=15):
+    """Compare the page detectors on each video.  The skimage SSIM detector is the
+    reference that the page changes from the other detectors are matched against.
+    """
+    for video_file_path in video_files:
+        logger.info(f"Benchmarking page detectors on {video_file_path}")
+        results = {name: run_detector(video_file_path, name) for name in detectors}
+        reference = results.get("ssim")
+        print(f"\n{video_file_path}")
+        print(f"{'detector':<12} {'frames':>7} {'ms/frame':>9} {'pages':>6} {'matched':>8} {'max |diff|':>11}")
+        for name, result in results.items():
+            if reference is not None:
+                matched = matched_pages(result["page_frames"], reference["page_frames"], tolerance)
+                n = min(len(result["scores"]), len(reference["scores"]))
+                max_diff = np.max(np.abs(result["scores"][:n] - reference["scores"][:n]), initial=0)
+                matched = f"{matched}/{len(reference['page_frames'])}"
+                max_diff = f"{max_diff:.4f}"
+            else:
+                matched = max_diff = "-"
+            print(
+                f"{name:<12} {result['frames']:>7} {result['ms_per_frame']:>9.3f} "
+                f"{len(result['page_frames']):>6} {matched:>8} {max_diff:>11}"
+            )
+
+
+def highlight_agreement(highlights, reference_highlights, tolerance=20):
+    """Share of frames where two runs highlight the same word: the same text, with box centers
+    within tolerance pixels, or no highlight in both runs.
+    """
+    num_frames = min(len(highlights), len(reference_highlights))
+    if num_frames == 0:
+        return 0.0
+    agree = 0
+    for highlight, reference in zip(highlights, reference_highlights):
+        if highlight is None or reference is None:
+            agree += highlight is None and reference is None
+            continue
+        center = np.array([(highlight[1] + highlight[3]) / 2, (highlight[2] + highlight[4]) / 2])
+        reference_center = np.array([(reference[1] + reference[3]) / 2, (reference[2] + reference[4]) / 2])
+        agree += highlight[0] == reference[0] and np.all(np.abs(center - reference_center) <= tolerance)
+    return agree / num_frames
+
+
+def benchmark_presets(video_files, presets, reference_preset="accurate"):
+    """Run the full pipeline on each video with each preset, and report the throughput and the
+    highlight accuracy.  There is no hand labelled ground truth for the demo videos, so the accuracy
+    is the agreement with the highlights of the reference preset.
+    """
+    from main import main
+    from stage_cache import StageCache
+
+    # Timing cached stages would measure the cache, not the preset
+    cache = StageCache(enabled=False)
+    presets = [reference_preset] + [x for x in presets if x != reference_preset]
+    for video_file_path in video_files:
+        results = {}
+        for preset in presets:
+            logger.info(f"Benchmarking preset {preset} on {video_file_path}")
+            start = time.perf_counter()
+            metrics = main(os.path.basename(video_file_path), page_to_image_file=False,
+                           settings=load_settings(preset), video_folder=os.path.dirname(video_file_path), cache=cache)
+            metrics["seconds"] = time.perf_counter() - start
+            results[preset] = metrics
+        reference = results[reference_preset]["highlights"]
+        print(f"\n{video_file_path} (accuracy is agreement with {reference_preset})")
+        print(f"{'preset':<10} {'seconds':>8} {'frames/s':>9} {'pages':>6} {'highlighted':>12} {'accuracy':>9}")
+        for preset, metrics in results.items():
+            highlighted = sum(x is not None for x in metrics["highlights"])
+            accuracy = highlight_agreement(metrics["highlights"], reference)
+            print(
+                f"{preset:<10} {metrics['seconds']:>8.1f} {metrics['frames'] / metrics['seconds']:>9.1f} "
+                f"{metrics['pages']:>6} {highlighted:>12} {accuracy:>9.1%}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    detectors_parser = subparsers.add_parser("detectors", help="Compare the page change detectors")
+    detectors_parser.add_argument("videos", type=str, nargs="*", help="Videos to benchmark, defaults to the demo videos")
+    detectors_parser.add_argument("--detectors", type=str, nargs="+", choices=PAGE_DETECTORS, default=list(PAGE_DETECTORS))
+    detectors_parser.add_argument("--tolerance", type=int, default=15, help="Frames a page change can be off by and still match")
+    presets_parser = subparsers.add_parser("presets", help="Compare the speed/quality presets on the full pipeline")
+    presets_parser.add_argument("videos", type=str, nargs="*", help="Videos to benchmark, defaults to the demo videos")
+    presets_parser.add_argument("--presets", type=str, nargs="+", choices=list(PRESETS), default=list(PRESETS))
+    presets_parser.add_argument("--reference", type=str, choices=list(PRESETS), default="accurate", help="Preset the highlight accuracy is measured against")
+    parser.add_argument("--log_level", type=str, help="Log Level (INFO or DEBUG)", default='INFO')
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    video_files = args.videos or sorted(glob.glob("../demo/*.mp4"))
+    if args.benchmark == "detectors":
+        benchmark_detectors(video_files, args.detectors, tolerance=args.tolerance)
+    elif args.benchmark == "presets":
+        benchmark_presets(video_files, args.presets, reference_preset=args.reference)
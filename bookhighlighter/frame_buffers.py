@@ -0,0 +1,94 @@
+import tracemalloc
+
+import numpy as np
+from loguru import logger
+
+
+class FrameBufferPool:
+    """Preallocated buffers for the per frame work in the main loop.  The video frame, the grey
+    frame and the two small frames used for page detection are written in place on each frame
+    instead of being allocated.  The "old" and "new" small frames are swapped rather than copied,
+    so a page detector can keep a reference to the last frame it was given until the next call.
+
+    Args:
+        height (int): frame height in pixels
+        width (int): frame width in pixels
+        scale (float): resize factor for the page detection frames. Defaults to 0.2.
+    """
+
+    def __init__(self, height, width, scale=0.2):
+        self.scale = scale
+        self.frame = np.empty((height, width, 3), dtype=np.uint8)
+        self.grey = np.empty((height, width), dtype=np.uint8)
+        # Same rounding OpenCV uses when resizing with fx and fy
+        small_shape = (max(int(round(height * scale)), 1), max(int(round(width * scale)), 1))
+        self.small = np.empty(small_shape, dtype=np.uint8)
+        self.small_old = np.empty(small_shape, dtype=np.uint8)
+
+    def read(self, cap):
+        """Read the next frame of a cv.VideoCapture into the frame buffer
+
+        Returns:
+            (bool, array): the same as cap.read()
+        """
+        ret, frame = cap.read(self.frame)
+        if ret:
+            # OpenCV returns a new array if the frame did not fit the buffer, keep that one instead
+            self.frame = frame
+        return ret, frame
+
+    def convert(self, frame):
+        """Fill the grey and small frames from a BGR frame.  The small frame from the
+        previous call becomes small_old.
+
+        Returns:
+            (array, array): the grey frame and the small frame
+        """
+        import cv2 as cv
+        self.grey = cv.cvtColor(frame, cv.COLOR_BGR2GRAY, dst=self.grey)
+        self.small, self.small_old = self.small_old, self.small
+        self.small = cv.resize(self.grey, (0, 0), dst=self.small, fx=self.scale, fy=self.scale)
+        return self.grey, self.small
+
+    def page_image(self):
+        """A full resolution PIL image of the current grey frame, for OCR.  The pixels are
+        copied, since the grey buffer is overwritten by the next frame.
+        """
+        from PIL import Image
+        return Image.fromarray(self.grey.copy())
+
+
+class FrameAllocationTracker:
+    """Measures the memory allocated while processing each frame with tracemalloc.  For each frame
+    it records the peak traced memory above the amount traced at the start of the frame, which
+    counts the temporary arrays that are freed before the frame ends.
+
+    tracemalloc slows the loop down, so this is only meant to be turned on to check the loop.
+    """
+
+    def __init__(self):
+        self.frame_peaks = []
+        self.frame_growth = []
+        self._start = 0
+
+    def start(self):
+        tracemalloc.start()
+
+    def begin_frame(self):
+        tracemalloc.reset_peak()
+        self._start = tracemalloc.get_traced_memory()[0]
+
+    def end_frame(self):
+        current, peak = tracemalloc.get_traced_memory()
+        self.frame_peaks.append(peak - self._start)
+        self.frame_growth.append(current - self._start)
+
+    def stop(self):
+        tracemalloc.stop()
+        if len(self.frame_peaks) > 0:
+            logger.info(
+                f"Per frame allocations over {len(self.frame_peaks)} frames: "
+                f"median peak {np.median(self.frame_peaks) / 1024:.1f}KiB, "
+                f"max peak {np.max(self.frame_peaks) / 1024:.1f}KiB, "
+                f"mean retained {np.mean(self.frame_growth) / 1024:.1f}KiB"
+            )
@@ -4,16 +4,15 @@ from itertools import chain
 import re
 import pickle
 import sys
-import whisper
 import os
 from io import BytesIO
 import zipfile
-from paddleocr import PaddleOCR,draw_ocr
-import skimage
-import pytesseract
-from pytesseract import Output
 from itertools import compress
 import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+import multiprocessing
 
 def create_image_zip_files(images, file_prefix, date_str):
     """
@@ -39,36 +38,39 @@ def create_image_zip_files(images, file_prefix, date_str):
 
 
 
-def create_file_paths(video_file_name, date):
-    video_file_folder = "../data/videos/"
-    video_file_path = video_file_folder + video_file_name
+def create_file_paths(video_file_name, date, video_file_folder="../data/videos/"):
+    video_file_path = os.path.join(video_file_folder, video_file_name)
 
     if os.path.exists(video_file_path):
         logger.info(f"File '{video_file_path}' exists.")
     else:
         logger.info(f"File '{video_file_path}' does not exist.")
 
-    video_output_folder = "../output/video/temp/" + date + "/"
-    video_output_file_path = video_output_folder + video_file_name.replace(
-        ".mp4", f"_words_highlighted_{date}.mp4"
+    final_video_folder = "../output/video/Final_Video/"
+    final_video_path = final_video_folder + video_file_name.replace(
+        ".mp4", f"_final_{date}.mp4"
     )
 
     transcript_file_name = video_file_name.replace(".mp4", "_transcription.pickle")
     transcript_file_folder = "../output/transcriptions/"
     transcript_file_path = transcript_file_folder + transcript_file_name
 
-    return video_file_path, video_output_file_path, transcript_file_path
+    return video_file_path, final_video_path, transcript_file_path
 
 
 
 
-def transcribe_audio(video_file_path, transcript_file_path, load_previous_file=True):
+def transcribe_audio(video_file_path, transcript_file_path, load_previous_file=True, model_name="medium", workers=1, max_chunk_seconds=120, cpu_budget=None):
     """
     Transcribe Audio Track using WhisperAI
 
     Args:
         video_file_name: 'The name and path of the video'
         load_previous_file: 'Checks if a previous transcription already exists and loads it'
+        model_name: 'The Whisper model size (e.g. tiny, base, small, medium, large)'
+        workers: 'Number of processes used to transcribe. More than 1 splits the audio into chunks at silences'
+        max_chunk_seconds: 'Longest audio chunk given to a single worker'
+        cpu_budget: 'CPUs shared by the workers, defaults to all of them'
 
     Returns:
      transcribed_result: transcription with timestamps
@@ -78,15 +80,137 @@ def transcribe_audio(video_file_path, transcript_file_path, load_previous_file=T
         with open(transcript_file_path, "rb") as file:
             transcribe_result = pickle.load(file)
     else:
-        logger.info("Starting Transcription")
-        model = whisper.load_model("medium")
-        transcribe_result = model.transcribe(video_file_path, word_timestamps=True)
+        logger.info(f"Starting Transcription, Model:{model_name}, Workers:{workers}")
+        if workers > 1:
+            transcribe_result = transcribe_audio_chunks(video_file_path, model_name, workers, max_chunk_seconds, cpu_budget)
+        else:
+            import whisper
+            model = whisper.load_model(model_name)
+            transcribe_result = model.transcribe(video_file_path, word_timestamps=True)
         with open(transcript_file_path, "wb") as file:
             pickle.dump(transcribe_result, file)
         logger.info(f"Wrote Transcription:{transcript_file_path}")
     return transcribe_result
 
 
+def find_silence_split_points(audio, sample_rate=16000, max_chunk_seconds=120, frame_seconds=0.02):
+    """
+    Split an audio track into chunks no longer than max_chunk_seconds.  Each split is 
+    made at the quietest point in the second half of the chunk, so words are not 
+    cut in two when there is a pause to split at.
+
+    Args:
+        audio: mono audio samples
+        sample_rate: samples per second of the audio
+        max_chunk_seconds: longest allowed chunk
+        frame_seconds: length of the frames the loudness is measured over
+
+    Returns:
+     chunks: list of (start_sample, end_sample) tuples covering the whole track
+    """
+    frame_length = max(int(frame_seconds * sample_rate), 1)
+    max_chunk = int(max_chunk_seconds * sample_rate)
+    num_frames = len(audio) // frame_length
+    frames = np.asarray(audio[:num_frames * frame_length], dtype=np.float32).reshape(num_frames, frame_length)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+
+    chunks = []
+    start = 0
+    while len(audio) - start > max_chunk:
+        # Only look for a pause in the second half, so chunks don't get too short
+        search_start = (start + max_chunk // 2) // frame_length
+        search_end = (start + max_chunk) // frame_length
+        quietest_frame = search_start + int(np.argmin(rms[search_start:search_end]))
+        end = quietest_frame * frame_length + frame_length // 2
+        chunks.append((start, end))
+        start = end
+    chunks.append((start, len(audio)))
+    return chunks
+
+
+def merge_chunk_transcriptions(chunk_results, chunk_offsets):
+    """
+    Combine the Whisper transcriptions of consecutive audio chunks into a single 
+    transcription, shifting each chunk's timestamps by the time the chunk starts
+
+    Args:
+        chunk_results: list of Whisper transcription results, one per chunk
+        chunk_offsets: start time in seconds of each chunk
+
+    Returns:
+     transcribed_result: transcription with the same structure as a single Whisper call
+    """
+    segments = []
+    texts = []
+    for result, offset in zip(chunk_results, chunk_offsets):
+        for segment in result["segments"]:
+            segment = dict(segment)
+            segment["id"] = len(segments)
+            segment["start"] = segment["start"] + offset
+            segment["end"] = segment["end"] + offset
+            if "seek" in segment:
+                # seek is in mel frames, 100 per second
+                segment["seek"] = segment["seek"] + int(round(offset * 100))
+            segment["words"] = [
+                dict(word, start=word["start"] + offset, end=word["end"] + offset)
+                for word in segment.get("words", [])
+            ]
+            segments.append(segment)
+        texts.append(result["text"].strip())
+    language = chunk_results[0].get("language") if len(chunk_results) > 0 else None
+    return {"text": " ".join(texts), "segments": segments, "language": language}
+
+
+_whisper_model = None
+
+
+def _init_transcribe_worker(model_name, threads):
+    global _whisper_model
+    import torch
+    import whisper
+    torch.set_num_threads(threads)
+    _whisper_model = whisper.load_model(model_name)
+
+
+def _transcribe_chunk(audio):
+    return _whisper_model.transcribe(audio, word_timestamps=True)
+
+
+def transcribe_audio_chunks(video_file_path, model_name="medium", workers=2, max_chunk_seconds=120, cpu_budget=None):
+    """
+    Transcribe the audio track in chunks on a pool of processes.  The audio is extracted
+    once, split at silences, and each process loads its own copy of the model.
+
+    Args:
+        video_file_path: 'The name and path of the video'
+        model_name: 'The Whisper model size'
+        workers: 'Number of processes'
+        max_chunk_seconds: 'Longest audio chunk given to a single worker'
+        cpu_budget: 'CPUs shared by the workers, defaults to all of them'
+
+    Returns:
+     transcribed_result: transcription with timestamps
+    """
+    import whisper
+    sample_rate = whisper.audio.SAMPLE_RATE
+    audio = whisper.load_audio(video_file_path)
+    chunks = find_silence_split_points(audio, sample_rate, max_chunk_seconds)
+    logger.info(f"Split audio into {len(chunks)} chunks")
+    cpu_budget = cpu_budget or os.cpu_count() or 1
+    workers = min(resolve_workers(workers, cpu_budget), len(chunks))
+    threads = max(cpu_budget // workers, 1)
+    # Spawn instead of fork, torch does not handle being forked after it has started threads
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_transcribe_worker,
+        initargs=(model_name, threads),
+    ) as executor:
+        chunk_results = list(executor.map(_transcribe_chunk, [audio[start:end] for start, end in chunks]))
+    chunk_offsets = [start / sample_rate for start, _ in chunks]
+    return merge_chunk_transcriptions(chunk_results, chunk_offsets)
+
+
 def transcription_clean(data):
     """
     Format and clean up the words from an Whisper Transcription
@@ -175,8 +299,9 @@ def word_search(
         The index of the found word, -1 otherwise.
     """
 
-    transcribed_words_np = np.array(transcribed_words)
-    ocr_words_np = np.array(ocr_words)
+    # asarray doesn't copy when the caller already passes numpy arrays
+    transcribed_words_np = np.asarray(transcribed_words)
+    ocr_words_np = np.asarray(ocr_words)
     output = ""
     search_word_loc = np.ravel(
         np.where(((start_times < timestamp) & (end_times > timestamp)))
@@ -299,7 +424,8 @@ def extract_pytesseract(data: dict):
             'left':[],
             'top':[],
             'width':[],
-            'height':[]
+            'height':[],
+            'conf':[]
             }
     text = data['text']
     #left = data['left']
@@ -313,11 +439,13 @@ def extract_pytesseract(data: dict):
     top_filtered = list(compress(data['top'], remove_list))
     width_filtered = list(compress(data['width'],remove_list))
     height_filtered = list(compress(data['height'], remove_list))
+    conf_filtered = [float(x) for x in compress(data['conf'], remove_list)]
     output['text'] = output['text'] + text_filtered
     output['left'] = output['left'] + left_filtered
     output['top'] = output['top'] + top_filtered
     output['width'] = output['width'] + width_filtered
     output['height'] = output['height'] + height_filtered
+    output['conf'] = output['conf'] + conf_filtered
     return(output)
 
 def calc_original_coordinates(data: dict, b_box:dict, left_border, upper_border):
@@ -379,7 +507,7 @@ def group_text_boxes(paddle_result):
     return(group)   
 
 def process_image(image):
-    
+    import skimage.filters
     image_np = np.array(image)
     thresh = skimage.filters.threshold_local(image_np, 25, offset=10)
     binary = image_np < thresh
@@ -401,8 +529,19 @@ def get_coordinates_paddle(paddle_result):
             'x1': max(x1),
             'y1': max(y1)}
 
+_paddle_ocr = None
+
+
+def get_paddle_ocr():
+    """Load PaddleOCR the first time it is needed, and reuse it after that"""
+    global _paddle_ocr
+    if _paddle_ocr is None:
+        from paddleocr import PaddleOCR
+        _paddle_ocr = PaddleOCR() # need to run only once to download and load model into memory
+    return _paddle_ocr
+
 def get_bounding_boxes_paddle(image):
-    ocr = PaddleOCR() # need to run only once to download and load model into memory
+    ocr = get_paddle_ocr()
     result = ocr.ocr(image,rec=False)
     return(result)
 
@@ -426,7 +565,109 @@ def to_bbox_dict(single_bbox):
         }
 
 
-def extract_text(image, return_original_coordinates=True, left_border = 10, right_border = 10, upper_border = 10, lower_border = 10):
+def resolve_workers(workers, cpu_budget=None):
+    """Limit a number of workers to the CPU budget
+
+    Args:
+        workers (int): the number of workers asked for
+        cpu_budget (int, optional): CPUs the pipeline may use. Defaults to all of them.
+
+    Returns:
+        int: between 1 and cpu_budget workers
+    """
+    cpu_budget = cpu_budget or os.cpu_count() or 1
+    return max(1, min(workers, cpu_budget))
+
+class OCRExecutor(ThreadPoolExecutor):
+    """Thread pool for the OCR workers, with the number of threads each of their tesseract processes may use"""
+
+    def __init__(self, workers, tesseract_threads):
+        super().__init__(max_workers=workers, thread_name_prefix='ocr')
+        self.tesseract_threads = tesseract_threads
+
+def create_ocr_executor(workers, cpu_budget=None):
+    """Create the thread pool used to OCR the text regions of a page at the same time.  pytesseract 
+    runs tesseract in a subprocess, so threads are enough to run them in parallel.  Each tesseract 
+    process is limited to its share of the CPU budget (see tesseract_thread_limit), so the workers
+    don't oversubscribe the machine.
+
+    Args:
+        workers (int): number of regions to OCR at the same time
+        cpu_budget (int, optional): CPUs the OCR may use. Defaults to all of them.
+
+    Returns:
+        OCRExecutor, or None when only one worker is used
+    """
+    cpu_budget = cpu_budget or os.cpu_count() or 1
+    workers = resolve_workers(workers, cpu_budget)
+    if workers == 1:
+        logger.info("OCR workers:1")
+        return None
+    tesseract_threads = max(cpu_budget // workers, 1)
+    logger.info(f"OCR workers:{workers}, tesseract threads per worker:{tesseract_threads}")
+    return OCRExecutor(workers, tesseract_threads)
+
+@contextmanager
+def tesseract_thread_limit(threads):
+    """Limit the OpenMP threads of the tesseract processes started inside the block.  pytesseract starts 
+    tesseract with the environment of this process, so OMP_THREAD_LIMIT is only set for the block, and 
+    libraries that start their OpenMP pool later (e.g. PaddleOCR) keep the whole machine.
+
+    Args:
+        threads (int, optional): threads per tesseract process, None leaves the environment alone
+    """
+    if threads is None:
+        yield
+        return
+    previous = os.environ.get('OMP_THREAD_LIMIT')
+    os.environ['OMP_THREAD_LIMIT'] = str(threads)
+    try:
+        yield
+    finally:
+        if previous is None:
+            del os.environ['OMP_THREAD_LIMIT']
+        else:
+            os.environ['OMP_THREAD_LIMIT'] = previous
+
+def ocr_region(image, b_box, return_original_coordinates=True, left_border = 10, right_border = 10, upper_border = 10, lower_border = 10):
+    """OCR a single text region found by PaddleOCR with pytesseract
+
+    Args:
+        image (PIL.Image): the page
+        b_box (dict): the region, from to_bbox_dict
+        return_original_coordinates (bool, optional): return the word boxes in page coordinates. Defaults to True.
+        left_border, right_border, upper_border, lower_border (int, optional): border for the crop box. Defaults to 10.
+
+    Returns:
+        dict: the text and the bounding boxes for each word, or None when there is no text in the region
+    """
+    import pytesseract
+    from pytesseract import Output
+    crop_image = image.crop((b_box['x0'] - left_border, b_box['y0']- upper_border, 
+                            b_box['x1']+right_border,max(b_box['y0'],b_box['y1'])+lower_border))
+    
+    
+    #processed_image = process_image(crop_image)
+    
+    #ocr_result = pytesseract.image_to_data(processed_image, output_type=Output.DICT)
+    ocr_result = pytesseract.image_to_data(crop_image, output_type=Output.DICT)
+    pytesseract_data = extract_pytesseract(ocr_result)
+    #PaddleOCR sometimes sees letters in things (e.g. clouds) where there are none.
+    #This filters out the bounding boxes where there is no text 
+    if len(pytesseract_data['text']) == 0:
+        return None
+    #The coordinates for the word level bounding boxes from pytessearct will be in reference to the 
+    #cropped image, not the entire image.  So we need to update the to location in the original image
+    #not the cropped one
+    original_coordinates = calc_original_coordinates(pytesseract_data, b_box, left_border, upper_border)
+    if return_original_coordinates:
+        pytesseract_data['left'] = original_coordinates['x0']
+        pytesseract_data['top'] = original_coordinates['y0']
+        pytesseract_data['right'] = original_coordinates['x1']
+        pytesseract_data['bottom'] = original_coordinates['y1']
+    return pytesseract_data
+
+def extract_text(image, return_original_coordinates=True, left_border = 10, right_border = 10, upper_border = 10, lower_border = 10, executor=None):
     """This extracts the text from the image and returns bounding boxes for each word.  It uses a two stage OCR pipeline, where 
     PaddleOCR is used to extrance line level boxes, and that information is then combined and fed to 
     pytessearct is used to extract word level boxes
@@ -438,11 +679,12 @@ def extract_text(image, return_original_coordinates=True, left_border = 10, righ
         right_border (int, optional): border for the crop box. Defaults to 10.
         upper_border (int, optional): border for the crop box. Defaults to 20.
         lower_border (int, optional): border for the crop box. Defaults to 20.
+        executor (Executor, optional): OCR the regions concurrently on this pool (see create_ocr_executor). 
+            Defaults to None, one region after another.
 
     Returns:
         dict: the text and the bounding boxes for each word 
     """
-    ocr_output = []
     image_np = np.array(image)
     image_x_max,image_y_max = image.size
     paddle_result = get_bounding_boxes_paddle(image_np)
@@ -461,29 +703,16 @@ def extract_text(image, return_original_coordinates=True, left_border = 10, righ
     #Sort the boxes vertically, and then left to right, as they are read in English
     ordered_boxes = sort_bboxes(paddle_result, image_x_max, image_y_max )
     b_boxes = [to_bbox_dict(x) for x in ordered_boxes]
-    for b_box in b_boxes:
-        crop_image = image.crop((b_box['x0'] - left_border, b_box['y0']- upper_border, 
-                                b_box['x1']+right_border,max(b_box['y0'],b_box['y1'])+lower_border))
-        
-        
-        #processed_image = process_image(crop_image)
-        
-        #ocr_result = pytesseract.image_to_data(processed_image, output_type=Output.DICT)
-        ocr_result = pytesseract.image_to_data(crop_image, output_type=Output.DICT)
-        pytesseract_data = extract_pytesseract(ocr_result)
-        #PaddleOCR sometimes sees letters in things (e.g. clouds) where there are none.
-        #This filters out the bounding boxes where there is no text 
-        if len(pytesseract_data['text']) > 0:
-            #The coordinates for the word level bounding boxes from pytessearct will be in reference to the 
-            #cropped image, not the entire image.  So we need to update the to location in the original image
-            #not the cropped one
-            original_coordinates = calc_original_coordinates(pytesseract_data, b_box, left_border, upper_border)
-            if return_original_coordinates:
-                pytesseract_data['left'] = original_coordinates['x0']
-                pytesseract_data['top'] = original_coordinates['y0']
-                pytesseract_data['right'] = original_coordinates['x1']
-                pytesseract_data['bottom'] = original_coordinates['y1']
-            ocr_output.append(pytesseract_data)
+    def ocr_b_box(b_box):
+        return ocr_region(image, b_box, return_original_coordinates, left_border, right_border, upper_border, lower_border)
+    #map returns the results in the order of b_boxes, so the reading order is kept when the
+    #regions are OCR'd concurrently.  PaddleOCR has already run, so the thread limit only applies to tesseract
+    if executor is not None and len(b_boxes) > 1:
+        with tesseract_thread_limit(getattr(executor, 'tesseract_threads', None)):
+            region_results = list(executor.map(ocr_b_box, b_boxes))
+    else:
+        region_results = [ocr_b_box(b_box) for b_box in b_boxes]
+    ocr_output = [x for x in region_results if x is not None]
     #Combine all the OCR results
     output = {}
     if len(ocr_output) > 0:
@@ -498,6 +727,148 @@ def extract_text(image, return_original_coordinates=True, left_border = 10, righ
                     output[key] = output[key] + i[key].copy()
     return output
 
+def extract_text_full_page(image, psm=3):
+    """Single pytesseract pass over the whole page.  This is much faster than extract_text, and is 
+    good enough on clean pages (e.g. dark text on a plain background)
+
+    Args:
+        image (PIL.Image): the page
+        psm (int, optional): tesseract page segmentation mode. Defaults to 3 (fully automatic).
+
+    Returns:
+        dict: the text, bounding boxes and confidence for each word, and the left edge of each text line
+    """
+    import pytesseract
+    from pytesseract import Output
+    ocr_result = pytesseract.image_to_data(image, output_type=Output.DICT, config=f'--psm {psm}')
+    output = extract_pytesseract(ocr_result)
+    output['right'] = [x + y for x,y in zip(output['left'], output['width'])]
+    output['bottom'] = [x + y for x,y in zip(output['top'], output['height'])]
+    #The left edge of the first word on each line, used to check the page layout
+    line_starts = {}
+    for i, word in enumerate(ocr_result['text']):
+        line_key = (ocr_result['block_num'][i], ocr_result['par_num'][i], ocr_result['line_num'][i])
+        if word.strip() != '' and line_key not in line_starts:
+            line_starts[line_key] = ocr_result['left'][i]
+    output['line_starts'] = list(line_starts.values())
+    return output
+
+def full_page_ocr_accepted(data, image_width, min_words=3, min_mean_conf=85, min_word_conf=60, max_low_conf_fraction=0.1):
+    """Decide if the result of extract_text_full_page can be used, or if the page needs
+    the two stage OCR pipeline
+
+    Args:
+        data (dict): output of extract_text_full_page
+        image_width (int): width of the page in pixels
+        min_words (int, optional): fewest words on an accepted page. Defaults to 3.
+        min_mean_conf (float, optional): lowest accepted average word confidence. Defaults to 85.
+        min_word_conf (float, optional): words below this confidence are counted as low confidence. Defaults to 60.
+        max_low_conf_fraction (float, optional): highest accepted share of low confidence words. Defaults to 0.1.
+
+    Returns:
+        (bool, str): if the result was accepted, and the reason
+    """
+    conf = data['conf']
+    if len(conf) < min_words:
+        return False, f'{len(conf)} words'
+    mean_conf = np.mean(conf)
+    if mean_conf < min_mean_conf:
+        return False, f'mean confidence {mean_conf:.0f}'
+    low_conf_fraction = np.mean(np.array(conf) < min_word_conf)
+    if low_conf_fraction > max_low_conf_fraction:
+        return False, f'{low_conf_fraction:.0%} low confidence words'
+    #Lines starting on both halves of the frame usually means two pages side by side. The
+    #two stage pipeline orders the text left page first (see sort_bboxes), tesseract might not
+    right_half = [(image_width - x) < x for x in data['line_starts']]
+    if any(right_half) and not all(right_half):
+        return False, 'text on both halves of the frame'
+    return True, f'{len(conf)} words, mean confidence {mean_conf:.0f}'
+
+def extract_text_cascade(image, psm=3, **kwargs):
+    """OCR a page with a single full page pytesseract pass first, and only fall back to the two stage 
+    pipeline in extract_text when the confidences or the layout of the fast pass don't look right
+
+    Args:
+        image (PIL.Image): the page
+        psm (int, optional): tesseract page segmentation mode for the fast pass. Defaults to 3.
+        kwargs: passed to extract_text
+
+    Returns:
+        (dict, dict): the text and bounding boxes for each word, and a report with the path taken, 
+        the reason and the time each path took
+    """
+    start = time.perf_counter()
+    data = extract_text_full_page(image, psm=psm)
+    accepted, reason = full_page_ocr_accepted(data, image.size[0])
+    report = {'path': 'full_page', 'reason': reason, 'full_page_seconds': time.perf_counter() - start}
+    if accepted:
+        del data['line_starts']
+        return data, report
+    #PaddleOCR is only loaded once a page needs it, and the load isn't part of the page's OCR time
+    get_paddle_ocr()
+    start = time.perf_counter()
+    output = extract_text(image, **kwargs)
+    report['path'] = 'two_stage'
+    report['two_stage_seconds'] = time.perf_counter() - start
+    return output, report
+
+def ocr_page(image, ocr_mode='two_stage', **kwargs):
+    """OCR a page with the two stage pipeline, or with the cascade
+
+    Args:
+        image (PIL.Image): the page
+        ocr_mode (str, optional): 'two_stage' or 'cascade'. Defaults to 'two_stage'.
+        kwargs: passed to extract_text
+
+    Returns:
+        (dict, dict): the text and bounding boxes for each word, and a report of the path taken
+    """
+    if ocr_mode == 'cascade':
+        return extract_text_cascade(image, **kwargs)
+    get_paddle_ocr()
+    start = time.perf_counter()
+    output = extract_text(image, **kwargs)
+    return output, {'path': 'two_stage', 'reason': 'two stage mode', 'two_stage_seconds': time.perf_counter() - start}
+
+def two_stage_reference_seconds(reports):
+    """Times of the pages in the reports that went through the two stage pipeline"""
+    return [x['two_stage_seconds'] for x in reports if 'two_stage_seconds' in x]
+
+def estimate_ocr_saving(report, previous_reports):
+    """Add the estimated time the full page path saved on a page to its report, as 'saved_seconds'.  The
+    two stage time of the page is estimated with the average two stage time of the pages so far.  Pages
+    that took the two stage path save nothing, and 'saved_seconds' is None when there is no two stage
+    time to compare with yet.
+
+    Returns:
+        dict: the report
+    """
+    if report['path'] != 'full_page':
+        report['saved_seconds'] = 0.0
+        return report
+    reference = two_stage_reference_seconds(previous_reports + [report])
+    report['saved_seconds'] = np.mean(reference) - report['full_page_seconds'] if len(reference) > 0 else None
+    return report
+
+def summarize_ocr_reports(reports):
+    """Summarize the cascade reports for a video.  The time saved on a page that took the full page path
+    is estimated with the average time of the pages that went through the two stage pipeline
+
+    Returns:
+        str: pages per path, total OCR time, and the estimated time saved
+    """
+    full_page = [x for x in reports if x['path'] == 'full_page']
+    two_stage_pages = [x for x in reports if x['path'] == 'two_stage']
+    reference = two_stage_reference_seconds(reports)
+    total_seconds = sum(x.get('full_page_seconds', 0) + x.get('two_stage_seconds', 0) for x in reports)
+    summary = f'OCR pages: {len(full_page)} full page, {len(two_stage_pages)} two stage, {total_seconds:.1f}s total'
+    if len(full_page) == 0:
+        return summary + ', 0.0s saved by the full page path'
+    if len(reference) == 0:
+        return summary + ', time saved by the full page path unknown (no two stage time to compare with)'
+    saved = sum(np.mean(reference) - x['full_page_seconds'] for x in full_page)
+    return summary + f', about {saved:.1f}s saved by the full page path'
+
 def clean_ocr_words(word_data):
     words = word_data['text']
     left = word_data['left']
@@ -518,17 +889,9 @@ def extract_audio(video_file_path, audio_file_path):
     result = subprocess.run([extract_audio_cmd], capture_output=True, text=True, shell=True)
     return result
 
-def combine_av(video_file_path, audio_file_path, final_video_path):
-    combine_video_cmd = f'ffmpeg -y -i {audio_file_path} -i {video_file_path} -c:v copy -c:a aac {final_video_path}'
+def combine_av(video_file_path, audio_file_path, final_video_path, encoder_preset=None):
+    #Without an encoder preset the highlighted video stream is copied as is, otherwise it is re-encoded with x264
+    video_codec = 'copy' if encoder_preset is None else f'libx264 -preset {encoder_preset}'
+    combine_video_cmd = f'ffmpeg -y -i {audio_file_path} -i {video_file_path} -c:v {video_codec} -c:a aac {final_video_path}'
     result = subprocess.run([combine_video_cmd], capture_output=True, text=True, shell=True)
     return result
-
-def create_final_video(video_file_name, video_original_file_path, video_output_file_path, current_date):
-    audio_file_name = video_file_name.replace('.mp4', '_audio_'+current_date+'.mp3')
-    audio_file_path = os.path.join(os.path.dirname(video_output_file_path),audio_file_name)
-
-    final_video_name = video_file_name.replace('.mp4', '_final_'+current_date+'.mp4')
-    final_video_path = '../output/video/Final_Video/' + final_video_name
-    result_audio = extract_audio(video_original_file_path, audio_file_path)
-    if result_audio.returncode == 0:
-        result_video = result = combine_av(video_output_file_path, audio_file_path, final_video_path)
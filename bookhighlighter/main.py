@@ -1,218 +1,101 @@
 # poetry run python main.py BB.mp4 --log_to_file
-import whisper
-import pickle
-import numpy as np
-import cv2 as cv
-from itertools import chain
-
-import pytesseract
-from pytesseract import Output
-from paddleocr import PaddleOCR
-from skimage.metrics import structural_similarity as ssim
-import re
-from PIL import Image
-from itertools import compress
-from collections import deque
 #import easyocr
 from loguru import logger
 import sys
 import os
 import argparse
+import shutil
+from functools import partial
 from datetime import datetime
-import zipfile
-from io import BytesIO
-import subprocess
 
-from functions import *
+# The OCR, transcription and image libraries are imported by the functions that use them,
+# so that --help and runs that don't need them start quickly
+from functions import (
+    configure_logging,
+    create_file_paths,
+)
+from page_detection import PAGE_DETECTORS
+from pipeline import run_pipeline, save_page_images
+from profiler import save_profile, start_profiler, stop_profiler
+from presets import PRESETS, load_settings
+from stage_cache import StageCache
+from work_queue import run_worker
+
+
+def main(video_file_name, page_to_image_file, settings=None, trace_allocations=False, video_folder='../data/videos/', cache=None):
+    #reader = easyocr.Reader(["en"])
 
+    # See presets.py for the settings, the balanced preset is the default
+    if settings is None:
+        settings = load_settings()
+    # Stage outputs are reused between runs, see stage_cache.py
+    if cache is None:
+        cache = StageCache()
 
-def main(video_file_name, page_to_image_file):
-    #reader = easyocr.Reader(["en"])
     current_date = datetime.now().strftime("%m_%d_%Y")
 
-    video_file_path, video_output_file_path, transcript_file_path = create_file_paths(video_file_name, current_date)
-    
-
-    temp_path = os.path.dirname(video_output_file_path)
-    if not os.path.exists(temp_path):
-        os.makedirs(temp_path)
-        print(f"Directory '{temp_path}' created.")
-    else:
-        print(f"Directory '{temp_path}' already exists.")
-    
-    logger.info(f"Creating Temp Directory {temp_path}")
-    
+    video_file_path, final_video_path, transcript_file_path = create_file_paths(video_file_name, current_date, video_folder)
 
     logger.info(f"Begin Highlighting {video_file_path}")
-
-    logger.info(f"Begin Transcribing Audio {video_file_path}")
-    transcribe_result = transcribe_audio(
-        video_file_path, transcript_file_path, load_previous_file=False
-    )
-    transcribed_words_clean, start_times, end_times = transcription_clean(
-        transcribe_result
-    )
-    logger.info(f"End Transcribing Audio {video_file_path}")
-
-    ocr_list = []
-    timestamps = []
-    frames_nums = []
-    cap = cv.VideoCapture(video_file_path)
-    cap_fps = cap.get(cv.CAP_PROP_FPS)
-    cap_height = cap.get(cv.CAP_PROP_FRAME_HEIGHT)
-    cap_width = cap.get(cv.CAP_PROP_FRAME_WIDTH)
-    logger.debug(f"Video FPS:{cap_fps}, Height:{cap_height}, Width:{cap_width}")
-
-    fourcc = cv.VideoWriter_fourcc(*"mp4v")
-    out = cv.VideoWriter(
-        video_output_file_path,
-        fourcc,
-        np.round(cap_fps, 2),
-        (int(cap_width), int(cap_height)),
-    )
-
-    font = cv.FONT_HERSHEY_SIMPLEX
-    ssim_value = -100
-    ssim_values = []
-    search_words = []
-    word_indexes = []
-    frame_list = {}
-    ssim_deque = deque(maxlen=5)
-    page_counter = 0
-    old_word_index = 0
-
-    all_images = []
-    logger.info(f"Begin Highlighting Video {video_file_path}")
-    while cap.isOpened():
-        ret, frame = cap.read()
-
-        # if frame is read correctly ret is True
-        if not ret:
-            print("Can't receive frame (stream end?). Exiting ...")
-            break
-
-        timestamp = cap.get(cv.CAP_PROP_POS_MSEC)
-        frame_number = int(cap.get(cv.CAP_PROP_POS_FRAMES))
-
-        grey_image = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
-        small_image = cv.resize(grey_image, (0, 0), fx=0.2, fy=0.2)
-        large_image = cv.resize(grey_image, (0, 0), fx=2, fy=2)
-
-        img_new = Image.fromarray(grey_image)
-
-        if ssim_value < 0:
-            small_image_old = small_image.copy()
-            
-            all_images.append(img_new)
-            
-            word_data = extract_text(img_new)
-            if 'text' in word_data:
-                clean_words_filtered, left_filtered, top_filtered, right_filtered, bottom_filtered = clean_ocr_words(word_data)
-            else: 
-                clean_words_filtered = []
-            
-            old_word_index = 0
-            ssim_stable = True
-
-        ssim_value = ssim(small_image_old, small_image)
-        ssim_values.append(ssim_value)
-        ssim_deque.append(ssim_value)
-
-        if ssim_value < 0.85:
-            ssim_stable = False
-
-        if (np.all(np.round(ssim_deque, 2) >= 0.95)) & (ssim_stable == False):
-            ssim_stable = True
-        
-            all_images.append(img_new)
-           
-            word_data = extract_text(img_new)
-            if 'text' in word_data:
-                clean_words_filtered, left_filtered, top_filtered, right_filtered, bottom_filtered = clean_ocr_words(word_data)
-            else: 
-                clean_words_filtered = []
-            #ocr_list.append((words, timestamp))
-            frame_list[frame_number] = ssim_value
-            page_counter = page_counter + 1
-            old_word_index = 0
-            frame_test = frame.copy()
-
-        
-        
-
-        if len(clean_words_filtered) > 0:
-            ocr_list.append((word_data['text'], timestamp))
-        else: 
-            clean_words_filtered = []
-        logger.debug(f'Page: {page_counter}, Words:{clean_words_filtered}')
-        word_index = word_search(
-            transcribed_words_clean,
-            clean_words_filtered,
-            timestamp / 1000,
-            start_times,
-            end_times,
-            old_word_index=old_word_index,
-        )
-        logger.debug(f"Main Function: Word Index {word_index}, Old Word Index {old_word_index}")
-        #if ((word_index > old_word_index) and (word_index - old_word_index < 3)):
-        if (word_index > old_word_index):
-            old_word_index = word_index
-
-        if word_index != -1:
-            # print(word_index)
-            # old_word_index = word_index
-            x0 = int(left_filtered[word_index])
-            x1 = int(right_filtered[word_index])
-            y0 = int(top_filtered[word_index])
-            y1 = int(bottom_filtered[word_index])
-            buffer = 5
-            cv.rectangle(
-                frame,
-                (x0 - buffer, y0 - buffer),
-                (x1 + buffer, y1 + buffer),
-                (0, 255, 0),
-                3,
-            )
-
-        # cv.putText(frame,
-        #         f'Time: {np.round(timestamp,2)}, SSIM: {np.round(ssim_value,2)}, Page: {page_counter}, Index:{word_index}, Old Index:{old_word_index}',
-        #             (50, 50),
-        #             font, 1,
-        #             (255, 0, 0),
-        #             2,
-        #             cv.LINE_4)
-        # cv.imshow('frame', frame)
-        # if cv.waitKey(1) == ord('q'):
-        #    break
-
-        out.write(frame)
-
-        small_image_old = small_image.copy()
-        
-
-    cap.release()
-    out.release()
-    cv.destroyAllWindows()
+    outputs = run_pipeline(video_file_path, transcript_file_path, settings, cache, trace_allocations)
     logger.info(f"End Highlighting:{video_file_path}")
-    logger.info(f"Output Video:{video_output_file_path}")
+    logger.info(f"Output Video:{outputs['highlighted_video_path']}")
 
     # if page_to_image_file:
     #     logger.info(f"Saving Images")
     #     for num,img in enumerate(all_images):
     #         img_fname = f'../output/images/{video_file_name}_page_{num}.jpg'
     #         img.save(img_fname)
+    page_starts = outputs['video_info']['page_starts']
     if page_to_image_file:
-        create_image_zip_files(all_images, os.path.splitext(file_path)[0], current_date)
-
-    create_final_video(video_file_name, video_file_path, video_output_file_path, current_date)
+        save_page_images(outputs['video_info']['page_image_paths'], os.path.splitext(video_file_name)[0], current_date)
+
+    os.makedirs(os.path.dirname(final_video_path), exist_ok=True)
+    shutil.copy(outputs['final_video_path'], final_video_path)
+    return {
+        'preset': settings['preset'],
+        'frames': len(outputs['highlights']),
+        'pages': len(page_starts),
+        'highlights': outputs['highlights'],
+        'ocr_paths': [x['path'] for x in outputs['page_ocr']['reports']],
+        'highlighted_video_path': outputs['highlighted_video_path'],
+        'final_video_path': final_video_path,
+    }
+
+def process_queued_video(video_path, output_dir, **options):
+    """Highlight a video claimed from a work queue, and copy the final video to the queue's output folder"""
+    metrics = main(os.path.basename(video_path), page_to_image_file=False, video_folder=os.path.dirname(video_path), **options)
+    shutil.copy(metrics['final_video_path'], output_dir)
+    # The per frame highlights are only needed by the benchmark, keep the published result small
+    highlights = metrics.pop('highlights')
+    metrics['highlighted_frames'] = sum(x is not None for x in highlights)
+    return metrics
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("movie_file", type=str, help="Movie path and filename")
+    parser.add_argument("movie_file", type=str, nargs='?', help="Movie path and filename")
     parser.add_argument("--log_level", type=str, help="Log Level (INFO or DEBUG)", default='INFO')
     parser.add_argument('--log_to_file', default=False, action=argparse.BooleanOptionalAction, help='Write Logs to file (True or False)')
+    parser.add_argument('--preset', type=str, choices=list(PRESETS), default=None, help='Speed/quality preset for all the stages, defaults to balanced')
+    parser.add_argument('--config', type=str, default=None, help='JSON file with settings that override the preset')
+    parser.add_argument('--page_detector', type=str, choices=PAGE_DETECTORS, default=None, help='Backend used to detect page changes')
+    parser.add_argument('--whisper_model', type=str, default=None, help='Whisper model size (e.g. tiny, base, small, medium, large)')
+    parser.add_argument('--transcribe_workers', type=int, default=None, help='Processes used to transcribe the audio, more than 1 splits the audio at silences')
+    parser.add_argument('--profile', default=False, action=argparse.BooleanOptionalAction, help='Profile the run and write flame graph stacks and a summary per stage')
+    parser.add_argument('--profile_interval', type=float, default=5, help='Milliseconds between profiler samples')
+    parser.add_argument('--trace_allocations', default=False, action=argparse.BooleanOptionalAction, help='Log the memory allocated per frame (slows the run down)')
+    parser.add_argument('--ocr_mode', type=str, choices=['two_stage', 'cascade'], default=None, help='two_stage runs PaddleOCR and pytesseract on every page, cascade tries a single pytesseract pass first')
+    parser.add_argument('--ocr_workers', type=int, default=None, help='Text regions on a page OCR\'d at the same time')
+    parser.add_argument('--cpu_budget', type=int, default=None, help='CPUs the transcription and OCR workers may use, defaults to all of them')
+    parser.add_argument('--queue_dir', type=str, default=None, help='Run as a worker on the videos in this shared queue directory instead of a single movie file')
+    parser.add_argument('--worker_id', type=str, default=None, help='Worker name in the queue, defaults to host name and process id')
+    parser.add_argument('--lease_seconds', type=float, default=120, help='Seconds without a heartbeat before another worker takes over a video')
+    parser.add_argument('--cache_dir', type=str, default='../output/cache/', help='Folder for the cached output of each pipeline stage')
+    parser.add_argument('--cache', default=True, action=argparse.BooleanOptionalAction, help='Reuse the output of stages whose settings and inputs have not changed')
     parser.add_argument('--page_to_image', default=False, action=argparse.BooleanOptionalAction, help='Writes the pages in the video as images in a zip file')
     args = parser.parse_args()
+    if args.movie_file is None and args.queue_dir is None:
+        parser.error('a movie file or --queue_dir is required')
     file_path = args.movie_file
     log_level = args.log_level
     save_image = args.page_to_image
@@ -224,5 +107,22 @@ if __name__ == "__main__":
         logger.add(sys.stderr, level=log_level)
     
     logger.info("Start Application")
-    main(file_path, page_to_image_file=save_image)
+    if args.profile:
+        start_profiler(interval=args.profile_interval / 1000)
+    settings = load_settings(args.preset, args.config, overrides=dict(
+        page_detector=args.page_detector, whisper_model=args.whisper_model,
+        transcribe_workers=args.transcribe_workers, ocr_mode=args.ocr_mode,
+        ocr_workers=args.ocr_workers, cpu_budget=args.cpu_budget))
+    options = dict(settings=settings, trace_allocations=args.trace_allocations,
+                   cache=StageCache(args.cache_dir, enabled=args.cache))
+    try:
+        if args.queue_dir is not None:
+            run_worker(args.queue_dir, partial(process_queued_video, **options),
+                       worker_id=args.worker_id, lease_seconds=args.lease_seconds)
+        else:
+            main(file_path, page_to_image_file=save_image, **options)
+    finally:
+        if args.profile:
+            profile_name = 'queue_worker' if file_path is None else os.path.splitext(os.path.basename(file_path))[0]
+            save_profile(stop_profiler(), profile_name, datetime.now().strftime("%m_%d_%Y"))
     logger.info("End Application")
@@ -0,0 +1,301 @@
+import queue
+import subprocess
+import threading
+from collections import deque
+
+import numpy as np
+from loguru import logger
+
+
+PAGE_DETECTORS = ("ssim", "ssim_cached", "frame_diff", "scdet")
+
+
+class PageTracker:
+    """Tracks the similarity scores between consecutive frames and decides when a new
+    page has settled on screen.  A page change starts when the score drops below
+    unstable_threshold, and the new page is reported once the last `window` scores
+    are all at or above stable_threshold.
+
+    Args:
+        unstable_threshold (float): scores below this mark the page as changing. Defaults to 0.85.
+        stable_threshold (float): scores at or above this count as a stable frame. Defaults to 0.95.
+        window (int): number of consecutive stable frames needed. Defaults to 5.
+    """
+
+    def __init__(self, unstable_threshold=0.85, stable_threshold=0.95, window=5):
+        self.unstable_threshold = unstable_threshold
+        self.stable_threshold = stable_threshold
+        self.scores = deque(maxlen=window)
+        self.stable = True
+
+    def update(self, score):
+        """Add the score for the current frame
+
+        Returns:
+            bool: True if a new stable page was found on this frame
+        """
+        self.scores.append(score)
+        if score < self.unstable_threshold:
+            self.stable = False
+        if (np.all(np.round(self.scores, 2) >= self.stable_threshold)) & (self.stable == False):
+            self.stable = True
+            return True
+        return False
+
+
+class SSIMDetector:
+    """Page change detector using the scikit-image SSIM implementation.  Both
+    images are processed from scratch on every call.
+    """
+
+    def __init__(self):
+        self.previous = None
+
+    def update(self, image):
+        """Compare a (small, grey) frame to the one passed on the previous call.
+        The image is kept for the next comparison, so it must not be overwritten
+        until the next call (FrameBufferPool swaps its buffers for this reason).
+
+        Returns:
+            float: similarity to the previous frame, 1.0 for the first frame
+        """
+        if self.previous is None:
+            score = 1.0
+        else:
+            from skimage.metrics import structural_similarity as ssim
+            score = ssim(self.previous, image)
+        self.previous = image
+        return score
+
+    def close(self):
+        pass
+
+
+class CachedSSIMDetector:
+    """SSIM with the same defaults as scikit-image (7x7 uniform window, K1=0.01, K2=0.03,
+    sample covariance) that keeps the window statistics of the previous frame.  Only
+    the new frame's mean, variance and the cross term are computed on each call,
+    which removes two of the five filter passes.
+
+    All the statistics and intermediate results are written into arrays that are
+    allocated on the first frame and reused, the previous and current statistics
+    are swapped rather than copied.
+    """
+
+    def __init__(self, win_size=7, k1=0.01, k2=0.03, data_range=255):
+        self.win_size = win_size
+        self.c1 = (k1 * data_range) ** 2
+        self.c2 = (k2 * data_range) ** 2
+        num_pixels = win_size ** 2
+        self.cov_norm = num_pixels / (num_pixels - 1)
+        self.pad = (win_size - 1) // 2
+        self.shape = None
+
+    def _allocate(self, shape):
+        def stats():
+            return {key: np.empty(shape, dtype=np.float64) for key in ("image", "mean", "mean_sq", "var")}
+        # The statistics of the newest frame are written to stats[index], the other entry
+        # holds the previous frame's once has_previous is set
+        self.stats = [stats(), stats()]
+        self.index = 0
+        self.has_previous = False
+        self.work = np.empty(shape, dtype=np.float64)
+        self.work2 = np.empty(shape, dtype=np.float64)
+        self.cross = np.empty(shape, dtype=np.float64)
+        self.shape = shape
+
+    def _filter(self, image, dst):
+        import cv2 as cv
+        return cv.blur(image, (self.win_size, self.win_size), dst=dst, borderType=cv.BORDER_REFLECT)
+
+    def _stats(self, image, stats):
+        np.copyto(stats["image"], image)
+        self._filter(stats["image"], stats["mean"])
+        np.multiply(stats["mean"], stats["mean"], out=stats["mean_sq"])
+        np.multiply(stats["image"], stats["image"], out=self.work)
+        var = self._filter(self.work, stats["var"])
+        var -= stats["mean_sq"]
+        var *= self.cov_norm
+
+    def update(self, image):
+        """Compare a (small, grey) frame to the one passed on the previous call.
+
+        Returns:
+            float: similarity to the previous frame, 1.0 for the first frame
+        """
+        if image.shape != self.shape:
+            self._allocate(image.shape)
+        current = self.stats[self.index]
+        previous = self.stats[1 - self.index]
+        self._stats(image, current)
+        self.index = 1 - self.index
+        if not self.has_previous:
+            self.has_previous = True
+            return 1.0
+
+        # a1 = 2 * mean_x * mean_y + c1 and a2 = 2 * cov + c2, in work and cross
+        work, work2, cross = self.work, self.work2, self.cross
+        np.multiply(previous["image"], current["image"], out=work2)
+        self._filter(work2, cross)
+        np.multiply(previous["mean"], current["mean"], out=work)
+        cross -= work
+        cross *= 2 * self.cov_norm
+        cross += self.c2
+        work *= 2
+        work += self.c1
+        work *= cross
+        # b1 = mean_x^2 + mean_y^2 + c1 and b2 = var_x + var_y + c2, in cross and work2
+        np.add(previous["mean_sq"], current["mean_sq"], out=cross)
+        cross += self.c1
+        np.add(previous["var"], current["var"], out=work2)
+        work2 += self.c2
+        cross *= work2
+        work /= cross
+        pad = self.pad
+        return float(work[pad:-pad, pad:-pad].mean())
+
+    def close(self):
+        pass
+
+
+class FrameDiffDetector:
+    """Page change detector that compares block averages of consecutive frames.
+    The block sums are read from an integral image, so the cost is one pass over the
+    frame.  The score is the fraction of blocks whose average grey level moved by
+    no more than `tolerance`, which is close to 1.0 on a still page.
+
+    Args:
+        block_size (int): width and height of each block in pixels. Defaults to 8.
+        tolerance (float): allowed change in a block's average grey level. Defaults to 8.
+    """
+
+    def __init__(self, block_size=8, tolerance=8):
+        self.block_size = block_size
+        self.tolerance = tolerance
+        self.previous = None
+        self.integral = None
+
+    def _block_means(self, image):
+        import cv2 as cv
+        # Reuses the integral image buffer after the first frame
+        integral = self.integral = cv.integral(image, self.integral)
+        height, width = image.shape[:2]
+        ys = np.arange(0, height - height % self.block_size + 1, self.block_size)
+        xs = np.arange(0, width - width % self.block_size + 1, self.block_size)
+        grid = integral[np.ix_(ys, xs)].astype(np.float64)
+        sums = grid[1:, 1:] - grid[:-1, 1:] - grid[1:, :-1] + grid[:-1, :-1]
+        return sums / (self.block_size ** 2)
+
+    def update(self, image):
+        """Compare a (small, grey) frame to the one passed on the previous call.
+
+        Returns:
+            float: fraction of unchanged blocks, 1.0 for the first frame
+        """
+        current = self._block_means(image)
+        previous = self.previous
+        self.previous = current
+        if previous is None or previous.size == 0:
+            return 1.0
+        return float(np.mean(np.abs(current - previous) <= self.tolerance))
+
+    def close(self):
+        pass
+
+
+class ScdetDetector:
+    """Page change detector backed by the ffmpeg scdet filter.  ffmpeg decodes the video
+    in a separate process and the scene scores are read from its output on a
+    background thread, so the detector only needs the frame count to stay in step
+    with the main loop. The images passed to update() are not used.
+
+    The scdet score is 0 to 100, and it is returned as 1 - score/100 so it can be used
+    with the same thresholds as SSIM.
+
+    ffmpeg scores every frame, so when the main loop only checks every frame_step frames,
+    each update() takes the scores of all the frames since the last call and returns the
+    largest change among them.
+
+    Args:
+        video_file_path (str): video to run scdet on, the same one read by the main loop
+        threshold (float): scdet threshold, only used by ffmpeg for its own logging. Defaults to 10.
+        timeout (float): seconds to wait for a score before giving up. Defaults to 30.
+        frame_step (int): frames between update() calls. Defaults to 1.
+    """
+
+    def __init__(self, video_file_path, threshold=10, timeout=30, frame_step=1):
+        self.timeout = timeout
+        self.frame_step = frame_step
+        self.updates = 0
+        self.scores = queue.Queue()
+        cmd = [
+            "ffmpeg", "-hide_banner", "-nostats", "-i", video_file_path, "-an",
+            "-vf", f"scdet=threshold={threshold},metadata=mode=print:file=-",
+            "-f", "null", "-",
+        ]
+        logger.debug(f"Starting scdet: {' '.join(cmd)}")
+        self.process = subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+        )
+        self.reader = threading.Thread(target=self._read_scores, daemon=True)
+        self.reader.start()
+
+    def _read_scores(self):
+        for line in self.process.stdout:
+            if line.startswith("lavfi.scd.score="):
+                self.scores.put(float(line.split("=", 1)[1]))
+        # Marks the end of the stream
+        self.scores.put(None)
+
+    def update(self, image=None):
+        """Get the score for the frames up to the next checked frame
+
+        Returns:
+            float: lowest similarity between consecutive frames since the last call, 1.0 once
+            ffmpeg has no more frames
+        """
+        # The first call is for the first frame, the later ones cover the frame_step frames since the last one
+        frames = 1 if self.updates == 0 else self.frame_step
+        self.updates = self.updates + 1
+        max_score = 0.0
+        for _ in range(frames):
+            try:
+                score = self.scores.get(timeout=self.timeout)
+            except queue.Empty:
+                logger.warning("Timed out waiting for scdet score")
+                break
+            if score is None:
+                # Keep returning the end marker for any later calls
+                self.scores.put(None)
+                break
+            max_score = max(max_score, score)
+        return 1 - max_score / 100
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+
+
+def create_page_detector(name, video_file_path=None, frame_step=1):
+    """Create a page change detector by name
+
+    Args:
+        name (str): one of PAGE_DETECTORS
+        video_file_path (str, optional): the video being processed, needed by scdet
+        frame_step (int, optional): frames between update() calls, needed by scdet. Defaults to 1.
+
+    Returns:
+        a detector with update(image) and close() methods
+    """
+    if name == "ssim":
+        return SSIMDetector()
+    if name == "ssim_cached":
+        return CachedSSIMDetector()
+    if name == "frame_diff":
+        return FrameDiffDetector()
+    if name == "scdet":
+        if video_file_path is None:
+            raise ValueError("The scdet page detector needs the video file path")
+        return ScdetDetector(video_file_path, frame_step=frame_step)
+    raise ValueError(f"Unknown page detector '{name}', choose from {', '.join(PAGE_DETECTORS)}")
@@ -0,0 +1,376 @@
+import os
+import pickle
+from bisect import bisect_right
+
+import numpy as np
+from loguru import logger
+
+import page_detection
+from functions import (
+    _init_transcribe_worker,
+    _transcribe_chunk,
+    calc_original_coordinates,
+    clean_ocr_words,
+    combine_av,
+    create_image_zip_files,
+    create_ocr_executor,
+    estimate_ocr_saving,
+    extract_audio,
+    extract_pytesseract,
+    extract_text,
+    extract_text_cascade,
+    extract_text_full_page,
+    find_silence_split_points,
+    full_page_ocr_accepted,
+    get_bounding_boxes_paddle,
+    get_paddle_ocr,
+    merge_chunk_transcriptions,
+    ocr_page,
+    ocr_region,
+    sort_bboxes,
+    summarize_ocr_reports,
+    tesseract_thread_limit,
+    to_bbox_dict,
+    transcribe_audio,
+    transcribe_audio_chunks,
+    transcription_clean,
+    two_stage_reference_seconds,
+    word_search,
+)
+from frame_buffers import FrameAllocationTracker, FrameBufferPool
+from page_detection import PageTracker, create_page_detector
+from profiler import set_stage
+from stage_cache import code_version
+
+
+# The pipeline is a graph of stages, each cached by StageCache under its settings and inputs:
+#
+#   video -> audio_extract -> transcript ------------------\
+#   video -> page_spans -> page_ocr ------------------------> alignment -> render -> mux
+#                      \----------------------------------/            /           /
+#   video -----------------------------------------------------------/           /
+#   audio_extract ----------------------------------------------------------------/
+#
+# The video is decoded twice: page_spans keeps a copy of the first frame of each page for
+# page_ocr, and render draws on the frames.
+
+
+def extract_audio_track(video_file_path, audio_file_path):
+    """Extract the audio track of the video, used for the transcription and the final video"""
+    result = extract_audio(video_file_path, audio_file_path)
+    if result.returncode != 0:
+        raise RuntimeError(f"Could not extract the audio from {video_file_path}: {result.stderr}")
+
+
+def detect_pages(video_file_path, settings, output_path, trace_allocations=False):
+    """Find the frames where a new page settles on screen.  The first frame of each page is saved
+    next to output_path as page_<n>.png, at full resolution in grey, for the OCR.
+
+    Writes a pickle to output_path with a dict of the fps and size of the video, the timestamp (ms)
+    of each frame, the frame index where each page starts and the page image file names
+    (see load_page_spans).
+    """
+    import cv2 as cv
+
+    cap = cv.VideoCapture(video_file_path)
+    cap_fps = cap.get(cv.CAP_PROP_FPS)
+    cap_height = int(cap.get(cv.CAP_PROP_FRAME_HEIGHT))
+    cap_width = int(cap.get(cv.CAP_PROP_FRAME_WIDTH))
+    logger.debug(f"Video FPS:{cap_fps}, Height:{cap_height}, Width:{cap_width}")
+
+    detector = create_page_detector(settings['page_detector'], video_file_path, frame_step=settings['frame_step'])
+    page_tracker = PageTracker(unstable_threshold=settings['unstable_threshold'],
+                               stable_threshold=settings['stable_threshold'],
+                               window=settings['stable_frames'])
+    frame_pool = FrameBufferPool(cap_height, cap_width, scale=settings['detection_scale'])
+    frame_step = settings['frame_step']
+    allocation_tracker = FrameAllocationTracker() if trace_allocations else None
+    if allocation_tracker is not None:
+        allocation_tracker.start()
+
+    output_dir = os.path.dirname(output_path)
+    timestamps = []
+    page_starts = []
+    page_images = []
+    frame_index = 0
+    while cap.isOpened():
+        if allocation_tracker is not None:
+            allocation_tracker.begin_frame()
+        set_stage('read_frame', len(page_starts) - 1)
+        ret, frame = frame_pool.read(cap)
+        if not ret:
+            break
+        timestamps.append(cap.get(cv.CAP_PROP_POS_MSEC))
+        # Page changes are only checked every frame_step frames
+        if frame_index % frame_step == 0:
+            set_stage('page_detect', len(page_starts) - 1)
+            grey_image, small_image = frame_pool.convert(frame)
+            ssim_value = detector.update(small_image)
+            # The first page starts on the first frame
+            if page_tracker.update(ssim_value) or frame_index == 0:
+                set_stage('save_page', len(page_starts))
+                page_starts.append(frame_index)
+                page_images.append(f"page_{len(page_images)}.png")
+                frame_pool.page_image().save(os.path.join(output_dir, page_images[-1]))
+        frame_index = frame_index + 1
+        if allocation_tracker is not None:
+            allocation_tracker.end_frame()
+
+    if allocation_tracker is not None:
+        allocation_tracker.stop()
+    detector.close()
+    cap.release()
+    logger.info(f"Found {len(page_starts)} pages in {frame_index} frames")
+    video_info = {
+        'fps': cap_fps,
+        'width': cap_width,
+        'height': cap_height,
+        'timestamps': np.array(timestamps),
+        'page_starts': page_starts,
+        'page_images': page_images,
+    }
+    with open(output_path, "wb") as file:
+        pickle.dump(video_info, file)
+
+
+def load_page_spans(spans_path):
+    """Load the output of detect_pages, with 'page_image_paths' set to the full paths of the page images"""
+    with open(spans_path, "rb") as file:
+        video_info = pickle.load(file)
+    video_info['page_image_paths'] = [os.path.join(os.path.dirname(spans_path), x) for x in video_info['page_images']]
+    return video_info
+
+
+def load_page_images(page_image_paths):
+    """Yields the page images saved by detect_pages as PIL images"""
+    from PIL import Image
+
+    for page_image_path in page_image_paths:
+        with Image.open(page_image_path) as image:
+            image.load()
+            yield image
+
+
+def ocr_pages(page_image_paths, settings):
+    """OCR the first frame of each page
+
+    Returns:
+        dict: the clean words and their boxes for each page, and the OCR report of each page
+    """
+    crop_border = settings['crop_border']
+    ocr_options = dict(left_border=crop_border, right_border=crop_border, upper_border=crop_border, lower_border=crop_border)
+    ocr_executor = create_ocr_executor(settings['ocr_workers'], settings['cpu_budget'])
+    pages = []
+    reports = []
+    for page_number, image in enumerate(load_page_images(page_image_paths)):
+        set_stage('ocr', page_number)
+        word_data, ocr_report = ocr_page(image, settings['ocr_mode'], executor=ocr_executor, **ocr_options)
+        estimate_ocr_saving(ocr_report, reports)
+        logger.info(f"Page {page_number} OCR: {ocr_report}")
+        reports.append(ocr_report)
+        if 'text' in word_data:
+            words, left, top, right, bottom = clean_ocr_words(word_data)
+        else:
+            words, left, top, right, bottom = [], [], [], [], []
+        logger.debug(f'Page: {page_number}, Words:{words}')
+        pages.append({'words': words, 'left': left, 'top': top, 'right': right, 'bottom': bottom})
+    if ocr_executor is not None:
+        ocr_executor.shutdown()
+    logger.info(summarize_ocr_reports(reports))
+    return {'pages': pages, 'reports': reports}
+
+
+def align_words(transcribe_result, pages, page_starts, timestamps):
+    """Find the word to highlight on each frame
+
+    Returns:
+        list: for each frame, None or the highlighted word and its box (word, x0, y0, x1, y1)
+    """
+    transcribed_words_clean, start_times, end_times = transcription_clean(transcribe_result)
+    # Convert once here, so word_search doesn't convert the whole transcript on every frame
+    transcribed_words_clean = np.array(transcribed_words_clean)
+    page_words = [np.array(page['words']) for page in pages]
+    highlights = []
+    page_number = -1
+    for frame_index, timestamp in enumerate(timestamps):
+        current_page = bisect_right(page_starts, frame_index) - 1
+        if current_page != page_number:
+            page_number = current_page
+            page = pages[page_number]
+            old_word_index = 0
+        set_stage('word_search', page_number)
+        word_index = word_search(
+            transcribed_words_clean,
+            page_words[page_number],
+            timestamp / 1000,
+            start_times,
+            end_times,
+            old_word_index=old_word_index,
+        )
+        logger.debug(f"Word Index {word_index}, Old Word Index {old_word_index}")
+        if (word_index > old_word_index):
+            old_word_index = word_index
+        if word_index != -1:
+            highlights.append((
+                page['words'][word_index],
+                int(page['left'][word_index]),
+                int(page['top'][word_index]),
+                int(page['right'][word_index]),
+                int(page['bottom'][word_index]),
+            ))
+        else:
+            highlights.append(None)
+    return highlights
+
+
+def render_video(video_file_path, highlights, page_starts, video_info, settings, output_path, trace_allocations=False):
+    """Draw the highlight boxes on the video, without audio"""
+    import cv2 as cv
+
+    cap = cv.VideoCapture(video_file_path)
+    fourcc = cv.VideoWriter_fourcc(*settings['video_codec'])
+    out = cv.VideoWriter(
+        output_path,
+        fourcc,
+        np.round(video_info['fps'], 2),
+        (video_info['width'], video_info['height']),
+    )
+    frame_pool = FrameBufferPool(video_info['height'], video_info['width'])
+    color = tuple(settings['highlight_color'])
+    buffer = settings['highlight_padding']
+    thickness = settings['highlight_thickness']
+    allocation_tracker = FrameAllocationTracker() if trace_allocations else None
+    if allocation_tracker is not None:
+        allocation_tracker.start()
+    for frame_index, highlight in enumerate(highlights):
+        if allocation_tracker is not None:
+            allocation_tracker.begin_frame()
+        set_stage('render', bisect_right(page_starts, frame_index) - 1)
+        ret, frame = frame_pool.read(cap)
+        if not ret:
+            break
+        if highlight is not None:
+            word, x0, y0, x1, y1 = highlight
+            cv.rectangle(
+                frame,
+                (x0 - buffer, y0 - buffer),
+                (x1 + buffer, y1 + buffer),
+                color,
+                thickness,
+            )
+        out.write(frame)
+        if allocation_tracker is not None:
+            allocation_tracker.end_frame()
+    if allocation_tracker is not None:
+        allocation_tracker.stop()
+    cap.release()
+    out.release()
+
+
+def mux_video(highlighted_video_path, audio_file_path, output_path, encoder_preset):
+    """Add the audio track to the highlighted video"""
+    result = combine_av(highlighted_video_path, audio_file_path, output_path, encoder_preset)
+    if result.returncode != 0:
+        raise RuntimeError(f"Could not combine the audio and video: {result.stderr}")
+
+
+# The code each stage runs, hashed into the stage's params so editing it invalidates the stage's
+# cached outputs.  The versions of the libraries and tools (whisper, PaddleOCR, tesseract, OpenCV,
+# ffmpeg) are not part of the keys, so clear the cache after upgrading them.
+STAGE_CODE = {
+    'audio_extract': (extract_audio_track, extract_audio),
+    'transcript': (transcribe_audio, transcribe_audio_chunks, find_silence_split_points, merge_chunk_transcriptions,
+                   _init_transcribe_worker, _transcribe_chunk),
+    'page_spans': (detect_pages, page_detection, FrameBufferPool),
+    'page_ocr': (ocr_pages, load_page_images, ocr_page, extract_text_cascade, extract_text_full_page,
+                 full_page_ocr_accepted, extract_text, get_bounding_boxes_paddle, get_paddle_ocr, sort_bboxes,
+                 to_bbox_dict, tesseract_thread_limit, ocr_region, extract_pytesseract, calc_original_coordinates,
+                 clean_ocr_words, estimate_ocr_saving, two_stage_reference_seconds),
+    'alignment': (align_words, transcription_clean, word_search),
+    'render': (render_video, FrameBufferPool),
+    'mux': (mux_video, combine_av),
+}
+
+
+def run_pipeline(video_file_path, transcript_file_path, settings, cache, trace_allocations=False):
+    """Run every stage of the pipeline, reusing the cached output of any stage whose settings and
+    inputs haven't changed
+
+    Args:
+        video_file_path (str): the video to highlight
+        transcript_file_path (str): where transcribe_audio also saves the transcription
+        settings (dict): from presets.load_settings
+        cache (StageCache): where the stage outputs are kept
+        trace_allocations (bool, optional): log per frame allocations in the frame loops. Defaults to False.
+
+    Returns:
+        dict: the output of each stage, and the final video path
+    """
+    video_key = cache.file_key(video_file_path)
+
+    set_stage('audio_extract')
+    audio_key, audio_file_path = cache.run(
+        'audio_extract', {'code': code_version(*STAGE_CODE['audio_extract'])}, [video_key],
+        lambda output_path: extract_audio_track(video_file_path, output_path), file_name='audio.wav')
+
+    set_stage('transcribe')
+    transcript_key, transcribe_result = cache.run(
+        'transcript',
+        {'whisper_model': settings['whisper_model'], 'chunked': settings['transcribe_workers'] > 1,
+         'code': code_version(*STAGE_CODE['transcript'])},
+        [audio_key],
+        lambda: transcribe_audio(audio_file_path, transcript_file_path, load_previous_file=False,
+                                 model_name=settings['whisper_model'], workers=settings['transcribe_workers'],
+                                 cpu_budget=settings['cpu_budget']))
+
+    page_settings = ['page_detector', 'detection_scale', 'frame_step', 'unstable_threshold', 'stable_threshold', 'stable_frames']
+    spans_key, spans_path = cache.run(
+        'page_spans',
+        dict({key: settings[key] for key in page_settings}, code=code_version(*STAGE_CODE['page_spans'])),
+        [video_key],
+        lambda output_path: detect_pages(video_file_path, settings, output_path, trace_allocations),
+        file_name='page_spans.pickle')
+    video_info = load_page_spans(spans_path)
+
+    ocr_key, page_ocr = cache.run(
+        'page_ocr',
+        {'ocr_mode': settings['ocr_mode'], 'crop_border': settings['crop_border'],
+         'code': code_version(*STAGE_CODE['page_ocr'])},
+        [spans_key],
+        lambda: ocr_pages(video_info['page_image_paths'], settings))
+
+    alignment_key, highlights = cache.run(
+        'alignment', {'code': code_version(*STAGE_CODE['alignment'])},
+        [transcript_key, ocr_key, spans_key],
+        lambda: align_words(transcribe_result, page_ocr['pages'], video_info['page_starts'], video_info['timestamps']))
+
+    render_settings = ['highlight_color', 'highlight_padding', 'highlight_thickness', 'video_codec']
+    render_key, highlighted_video_path = cache.run(
+        'render',
+        dict({key: settings[key] for key in render_settings}, code=code_version(*STAGE_CODE['render'])),
+        [video_key, alignment_key, spans_key],
+        lambda output_path: render_video(video_file_path, highlights, video_info['page_starts'], video_info,
+                                         settings, output_path, trace_allocations),
+        file_name='highlighted.mp4')
+
+    set_stage('final_video')
+    mux_key, final_video_path = cache.run(
+        'mux', {'encoder_preset': settings['encoder_preset'], 'code': code_version(*STAGE_CODE['mux'])},
+        [render_key, audio_key],
+        lambda output_path: mux_video(highlighted_video_path, audio_file_path, output_path, settings['encoder_preset']),
+        file_name='final.mp4')
+
+    return {
+        'video_info': video_info,
+        'page_ocr': page_ocr,
+        'highlights': highlights,
+        'highlighted_video_path': highlighted_video_path,
+        'final_video_path': final_video_path,
+    }
+
+
+def save_page_images(page_image_paths, file_prefix, date_str):
+    """Write the first frame of each page to a zip file"""
+    set_stage('save_images')
+    images = list(load_page_images(page_image_paths))
+    create_image_zip_files(images, file_prefix, date_str)
@@ -0,0 +1,103 @@
+import json
+
+from loguru import logger
+
+
+# balanced keeps the settings the pipeline has always used, except for the page detector: ssim_cached
+# gives the same scores as the skimage ssim without allocating full size arrays on every frame
+PRESETS = {
+    "fast": {
+        "whisper_model": "base",
+        "transcribe_workers": 1,
+        "page_detector": "ssim_cached",
+        "detection_scale": 0.1,
+        "frame_step": 3,
+        "unstable_threshold": 0.85,
+        "stable_threshold": 0.95,
+        "stable_frames": 3,
+        "ocr_mode": "cascade",
+        "ocr_workers": 4,
+        "crop_border": 10,
+        "video_codec": "mp4v",
+        "encoder_preset": None,
+        "highlight_color": [0, 255, 0],
+        "highlight_padding": 5,
+        "highlight_thickness": 3,
+    },
+    "balanced": {
+        "whisper_model": "medium",
+        "transcribe_workers": 1,
+        "page_detector": "ssim_cached",
+        "detection_scale": 0.2,
+        "frame_step": 1,
+        "unstable_threshold": 0.85,
+        "stable_threshold": 0.95,
+        "stable_frames": 5,
+        "ocr_mode": "two_stage",
+        "ocr_workers": 1,
+        "crop_border": 10,
+        "video_codec": "mp4v",
+        "encoder_preset": None,
+        "highlight_color": [0, 255, 0],
+        "highlight_padding": 5,
+        "highlight_thickness": 3,
+    },
+    "accurate": {
+        "whisper_model": "large",
+        "transcribe_workers": 1,
+        "page_detector": "ssim_cached",
+        "detection_scale": 0.3,
+        "frame_step": 1,
+        "unstable_threshold": 0.85,
+        "stable_threshold": 0.95,
+        "stable_frames": 8,
+        "ocr_mode": "two_stage",
+        "ocr_workers": 1,
+        "crop_border": 15,
+        "video_codec": "mp4v",
+        "encoder_preset": "slow",
+        "highlight_color": [0, 255, 0],
+        "highlight_padding": 5,
+        "highlight_thickness": 3,
+    },
+}
+DEFAULT_PRESET = "balanced"
+# Not part of the presets, these depend on the machine rather than the speed/quality trade off
+MACHINE_SETTINGS = {"cpu_budget": None}
+
+
+def load_settings(preset=None, config_file=None, overrides=None):
+    """Build the pipeline settings.  Each level overrides the one before it: the preset
+    (balanced by default), the config file, then the overrides (e.g. command line options).
+
+    The config file is JSON with any of the preset keys, and can also name a "preset" to start
+    from, for example {"preset": "fast", "whisper_model": "small"}.
+
+    Args:
+        preset (str, optional): one of PRESETS
+        config_file (str, optional): path of a JSON config file
+        overrides (dict, optional): settings to apply last, entries set to None are ignored
+
+    Returns:
+        dict: the settings
+    """
+    config = {}
+    if config_file is not None:
+        with open(config_file) as file:
+            config = json.load(file)
+        logger.info(f"Loaded config file {config_file}")
+    preset = preset or config.pop("preset", None) or DEFAULT_PRESET
+    config.pop("preset", None)
+    if preset not in PRESETS:
+        raise ValueError(f"Unknown preset '{preset}', choose from {', '.join(PRESETS)}")
+
+    settings = dict(PRESETS[preset], **MACHINE_SETTINGS)
+    settings["preset"] = preset
+    unknown = set(config) - set(settings)
+    if len(unknown) > 0:
+        raise ValueError(f"Unknown settings in {config_file}: {', '.join(sorted(unknown))}")
+    settings.update(config)
+    if overrides is not None:
+        settings.update({key: value for key, value in overrides.items() if value is not None})
+    logger.info(f"Settings: {settings}")
+    return settings
@@ -0,0 +1,145 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+from loguru import logger
+
+
+class SamplingProfiler:
+    """Low overhead sampling profiler for the pipeline.  A background thread wakes up every
+    `interval` seconds and records the Python stack of the profiled thread, tagged with the
+    current pipeline stage and page number.
+
+    The time spent taking samples is tracked, and the interval is doubled whenever it goes
+    over max_overhead of the elapsed time, so the profiler never slows the run down by more
+    than a few percent.
+
+    Args:
+        interval (float): seconds between samples. Defaults to 0.005.
+        max_overhead (float): largest fraction of the run time spent sampling. Defaults to 0.03.
+        thread_id (int, optional): the thread to sample. Defaults to the thread calling start().
+    """
+
+    def __init__(self, interval=0.005, max_overhead=0.03, thread_id=None):
+        self.interval = interval
+        self.max_overhead = max_overhead
+        self.thread_id = thread_id
+        self.stage = "startup"
+        self.page = None
+        self.stacks = Counter()
+        self.stage_functions = defaultdict(Counter)
+        self.stage_counts = Counter()
+        self.sampling_seconds = 0
+        self.elapsed_seconds = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def set_stage(self, stage, page=None):
+        self.stage = stage
+        self.page = page
+
+    def start(self):
+        if self.thread_id is None:
+            self.thread_id = threading.get_ident()
+        self._start_time = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed_seconds = time.perf_counter() - self._start_time
+        logger.info(
+            f"Profiler took {sum(self.stage_counts.values())} samples, "
+            f"overhead {self.overhead():.2%}, final interval {self.interval * 1000:.1f}ms"
+        )
+
+    def overhead(self):
+        elapsed = self.elapsed_seconds or (time.perf_counter() - self._start_time)
+        return self.sampling_seconds / elapsed if elapsed > 0 else 0
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            sample_start = time.perf_counter()
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self._record(frame)
+            self.sampling_seconds += time.perf_counter() - sample_start
+            if self.overhead() > self.max_overhead:
+                self.interval = self.interval * 2
+
+    def _record(self, frame):
+        stage = self.stage
+        page = self.page
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        if len(names) == 0:
+            return
+        names.reverse()
+        tags = [stage] if page is None else [stage, f"page {page}"]
+        self.stacks[";".join(tags + names)] += 1
+        self.stage_functions[stage][names[-1]] += 1
+        self.stage_counts[stage] += 1
+
+    def write_collapsed(self, file_path):
+        """Write the samples in the collapsed stack format read by flamegraph.pl and speedscope"""
+        with open(file_path, "w") as file:
+            for stack, count in self.stacks.items():
+                file.write(f"{stack} {count}\n")
+        logger.info(f"Wrote Profile:{file_path}")
+
+    def summary(self, top_n=10):
+        """
+        Returns:
+            str: the share of samples in each stage, and the functions with the most samples in each stage
+        """
+        total = max(sum(self.stage_counts.values()), 1)
+        lines = []
+        for stage, count in self.stage_counts.most_common():
+            lines.append(f"{stage}: {count} samples ({count / total:.1%})")
+            for name, function_count in self.stage_functions[stage].most_common(top_n):
+                lines.append(f"    {function_count:>7} {function_count / count:>6.1%}  {name}")
+        return "\n".join(lines)
+
+
+_profiler = None
+
+
+def start_profiler(interval=0.005, max_overhead=0.03):
+    """Start profiling the calling thread. set_stage() tags the samples until stop_profiler() is called"""
+    global _profiler
+    _profiler = SamplingProfiler(interval=interval, max_overhead=max_overhead)
+    _profiler.start()
+    return _profiler
+
+
+def stop_profiler():
+    global _profiler
+    profiler = _profiler
+    _profiler = None
+    if profiler is not None:
+        profiler.stop()
+    return profiler
+
+
+def save_profile(profiler, file_prefix, date_str, top_n=10):
+    """Write the collapsed stacks and the per stage summary of a finished profile to the output folder"""
+    profile_folder = "../output/profiles/"
+    os.makedirs(profile_folder, exist_ok=True)
+    profiler.write_collapsed(f"{profile_folder}{file_prefix}_{date_str}.collapsed")
+    summary = profiler.summary(top_n)
+    summary_file_path = f"{profile_folder}{file_prefix}_{date_str}_summary.txt"
+    with open(summary_file_path, "w") as file:
+        file.write(summary + "\n")
+    logger.info(f"Profile Summary:\n{summary}")
+
+
+def set_stage(stage, page=None):
+    """Tag the following samples with a pipeline stage and page.  Does nothing when not profiling"""
+    if _profiler is not None:
+        _profiler.set_stage(stage, page)
@@ -0,0 +1,127 @@
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import shutil
+
+from loguru import logger
+
+
+class StageCache:
+    """Stores the output of each pipeline stage under a key made from the stage name, the stage's
+    settings and the keys of its inputs.  A stage is only run again when one of those changes,
+    so e.g. changing the highlight color only reruns the render and mux stages.
+
+    Stage outputs are kept in <cache_dir>/<stage>/ either as a pickle (<key>.pickle) or, for
+    stages that write a file such as a video, in a folder (<key>/<file name>).  Several processes
+    can share a cache folder.  When two of them compute the same key at the same time, the first
+    output stored is kept and used by both.
+
+    Args:
+        cache_dir (str): folder for the cached outputs
+        enabled (bool): when False every stage is run and no cached output is reused.  Pickled
+            outputs are not stored.  File stages still store their output, since the later stages read
+            it from the cache folder, but an existing output for the same key is kept. Defaults to True.
+    """
+
+    def __init__(self, cache_dir="../output/cache/", enabled=True):
+        self.cache_dir = cache_dir
+        self.enabled = enabled
+        self.file_hashes_path = os.path.join(cache_dir, "file_hashes.json")
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, stage, params, inputs):
+        """Key for a stage run
+
+        Args:
+            stage (str): stage name
+            params (dict): the settings that change the stage's output, must be JSON serializable
+            inputs (list): keys of the stage's inputs (other stage keys or file_key())
+        """
+        description = json.dumps({"stage": stage, "params": params, "inputs": inputs}, sort_keys=True, default=str)
+        return hashlib.sha256(description.encode()).hexdigest()[:32]
+
+    def file_key(self, file_path):
+        """Content hash of an input file.  Hashes are remembered by path, size and modification
+        time, so a large video is only read once while it is unchanged.
+        """
+        stat = os.stat(file_path)
+        file_id = f"{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+        file_hashes = {}
+        if os.path.exists(self.file_hashes_path):
+            with open(self.file_hashes_path) as file:
+                file_hashes = json.load(file)
+        if file_id not in file_hashes:
+            sha256 = hashlib.sha256()
+            with open(file_path, "rb") as file:
+                for block in iter(lambda: file.read(1 << 20), b""):
+                    sha256.update(block)
+            file_hashes[file_id] = sha256.hexdigest()
+            temp_path = f"{self.file_hashes_path}.{os.getpid()}.tmp"
+            with open(temp_path, "w") as file:
+                json.dump(file_hashes, file)
+            os.replace(temp_path, self.file_hashes_path)
+        return "file:" + file_hashes[file_id]
+
+    def run(self, stage, params, inputs, compute, file_name=None):
+        """Return the cached output of a stage, or compute and store it
+
+        Args:
+            stage (str): stage name
+            params (dict): the settings that change the stage's output
+            inputs (list): keys of the stage's inputs
+            compute (callable): computes the output.  Called with no arguments for stages whose output
+                is pickled, or with the path to write to when file_name is given.
+            file_name (str, optional): the stage writes this file instead of returning a value
+
+        Returns:
+            (str, object): the stage key, and the output (the file path for file stages)
+        """
+        key = self.key(stage, params, inputs)
+        stage_dir = os.path.join(self.cache_dir, stage)
+        os.makedirs(stage_dir, exist_ok=True)
+        if file_name is not None:
+            output_dir = os.path.join(stage_dir, key)
+            output_path = os.path.join(output_dir, file_name)
+            if self.enabled and os.path.exists(output_path):
+                logger.info(f"Stage {stage}: cached {key}")
+                return key, output_path
+            logger.info(f"Stage {stage}: running {key}")
+            # Written to a separate folder first, so an interrupted run never leaves a partial output
+            partial_dir = f"{output_dir}.{os.getpid()}.partial"
+            os.makedirs(partial_dir, exist_ok=True)
+            compute(os.path.join(partial_dir, file_name))
+            try:
+                os.rename(partial_dir, output_dir)
+            except OSError:
+                # Another process stored this key first.  Its output is kept, since it may be using it
+                if not os.path.exists(output_path):
+                    raise
+                logger.info(f"Stage {stage}: keeping the output stored first for {key}")
+                shutil.rmtree(partial_dir)
+            return key, output_path
+
+        output_path = os.path.join(stage_dir, key + ".pickle")
+        if self.enabled and os.path.exists(output_path):
+            logger.info(f"Stage {stage}: cached {key}")
+            with open(output_path, "rb") as file:
+                return key, pickle.load(file)
+        logger.info(f"Stage {stage}: running {key}")
+        value = compute()
+        if self.enabled:
+            temp_path = f"{output_path}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as file:
+                pickle.dump(value, file)
+            os.replace(temp_path, output_path)
+        return key, value
+
+
+def code_version(*objects):
+    """Hash of the source code of some functions, classes or modules, for stage params, so editing
+    e.g. word_search invalidates the stages that depend on it
+    """
+    sha256 = hashlib.sha256()
+    for code in objects:
+        sha256.update(inspect.getsource(code).encode())
+    return sha256.hexdigest()[:16]
@@ -0,0 +1,250 @@
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+
+from loguru import logger
+
+
+class WorkQueue:
+    """A work queue of videos kept in a shared directory (e.g. an NFS volume), so any number of
+    worker processes on any number of machines can process a batch without an external service.
+
+    The queue directory has three folders:
+        videos/   the videos to process, one job per file
+        leases/   <video>.lease while a worker is processing the video
+        results/  <video>.json with the status and metrics once a worker is done, and any output files
+
+    A worker claims a video by creating its lease file with O_CREAT | O_EXCL, which only one worker
+    can do.  While it works on the video, a heartbeat thread touches the lease file.  A lease that
+    hasn't been touched for lease_seconds is stale (the worker crashed or lost the volume), and any
+    worker can take it over.  The lease expiry compares the file's modification time to the local
+    clock, so the machines' clocks need to agree to well within lease_seconds.
+
+    A video that failed also gets a result, with status "failed".  Delete the result file to
+    run it again.
+
+    Args:
+        queue_dir (str): the shared directory
+        worker_id (str, optional): name of this worker. Defaults to host name and process id.
+        lease_seconds (float): time without a heartbeat after which a lease is stale. Defaults to 120.
+    """
+
+    def __init__(self, queue_dir, worker_id=None, lease_seconds=120):
+        self.queue_dir = queue_dir
+        self.videos_dir = os.path.join(queue_dir, "videos")
+        self.leases_dir = os.path.join(queue_dir, "leases")
+        self.results_dir = os.path.join(queue_dir, "results")
+        for folder in (self.videos_dir, self.leases_dir, self.results_dir):
+            os.makedirs(folder, exist_ok=True)
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_seconds = lease_seconds
+
+    def lease_path(self, video_name):
+        return os.path.join(self.leases_dir, video_name + ".lease")
+
+    def result_path(self, video_name):
+        return os.path.join(self.results_dir, video_name + ".json")
+
+    def pending(self):
+        """Videos that don't have a result yet, including the ones being processed"""
+        return [
+            name for name in sorted(os.listdir(self.videos_dir))
+            if not name.startswith(".") and not os.path.exists(self.result_path(name))
+        ]
+
+    def claim(self):
+        """Claim the next pending video that isn't leased, or whose lease is stale
+
+        Returns:
+            Lease: the claimed lease, or None if there is nothing to claim right now
+        """
+        for video_name in self.pending():
+            token = self._acquire(video_name)
+            if token is not None:
+                # Another worker may have finished the video between pending() and the claim
+                if os.path.exists(self.result_path(video_name)):
+                    os.remove(self.lease_path(video_name))
+                    continue
+                logger.info(f"{self.worker_id} claimed {video_name}")
+                return Lease(self, video_name, token)
+        return None
+
+    def _acquire(self, video_name):
+        path = self.lease_path(video_name)
+        token = uuid.uuid4().hex
+        lease = {"worker": self.worker_id, "token": token, "claimed_at": time.time()}
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self._break_stale(path):
+                    return None
+                continue
+            with os.fdopen(fd, "w") as file:
+                json.dump(lease, file)
+            return token
+        return None
+
+    def _break_stale(self, path):
+        """Remove a stale lease so it can be claimed again
+
+        Returns:
+            bool: True if the lease was stale and has been removed
+        """
+        try:
+            with open(path) as file:
+                stale_contents = file.read()
+            age = time.time() - os.stat(path).st_mtime
+        except FileNotFoundError:
+            # The lease was released in the meantime
+            return True
+        if age < self.lease_seconds:
+            return False
+        # Moving the lease aside is atomic, so only one worker removes it.  If the lease we moved
+        # isn't the stale one we read, another worker broke the stale lease and claimed the video
+        # first, so put its lease back.
+        moved_path = f"{path}.stale.{uuid.uuid4().hex}"
+        try:
+            os.rename(path, moved_path)
+        except FileNotFoundError:
+            return False
+        with open(moved_path) as file:
+            moved_contents = file.read()
+        if moved_contents != stale_contents:
+            try:
+                os.link(moved_path, path)
+            except FileExistsError:
+                pass
+            os.remove(moved_path)
+            return False
+        os.remove(moved_path)
+        logger.warning(f"{self.worker_id} took over stale lease {os.path.basename(path)}: {stale_contents}")
+        return True
+
+    def publish(self, video_name, result, output_dir=None):
+        """Write the result of a video, replacing the file in one step so readers never see a partial result.
+        The output files in output_dir are moved to results/<video name without extension>/ first.
+        """
+        if output_dir is not None:
+            final_output_dir = os.path.join(self.results_dir, os.path.splitext(video_name)[0])
+            if os.path.exists(final_output_dir):
+                shutil.rmtree(final_output_dir)
+            os.rename(output_dir, final_output_dir)
+            result["outputs"] = sorted(os.listdir(final_output_dir))
+        result_path = self.result_path(video_name)
+        temp_path = f"{result_path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(result, file, indent=2, default=str)
+        os.replace(temp_path, result_path)
+
+
+class Lease:
+    """A claimed video.  start_heartbeat() keeps the lease fresh until release() is called"""
+
+    def __init__(self, queue, video_name, token):
+        self.queue = queue
+        self.video_name = video_name
+        self.token = token
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def video_path(self):
+        return os.path.join(self.queue.videos_dir, self.video_name)
+
+    def start_heartbeat(self, heartbeat_seconds):
+        self._thread = threading.Thread(target=self._heartbeat, args=(heartbeat_seconds,), daemon=True)
+        self._thread.start()
+
+    def _heartbeat(self, heartbeat_seconds):
+        path = self.queue.lease_path(self.video_name)
+        while not self._stop.wait(heartbeat_seconds):
+            lease = read_lease(path)
+            if lease is None or lease.get("token") != self.token:
+                logger.warning(f"{self.queue.worker_id} lost the lease on {self.video_name}")
+                self.lost = True
+                return
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                # Another worker broke the lease as stale since it was read
+                logger.warning(f"{self.queue.worker_id} lost the lease on {self.video_name}")
+                self.lost = True
+                return
+
+    def release(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        path = self.queue.lease_path(self.video_name)
+        lease = read_lease(path)
+        if lease is not None and lease.get("token") == self.token:
+            os.remove(path)
+
+
+def read_lease(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        # A lease that is being written is treated as unreadable
+        return None
+
+
+def run_worker(queue_dir, process_video, worker_id=None, lease_seconds=120, heartbeat_seconds=None, poll_seconds=10, exit_when_done=True):
+    """Claim and process videos from a shared queue directory until they all have results
+
+    Args:
+        queue_dir (str): the shared directory, see WorkQueue
+        process_video (callable): called as process_video(video_path, output_dir) and returns a dict
+            of metrics.  Output files written to output_dir are published with the result.
+        worker_id (str, optional): name of this worker. Defaults to host name and process id.
+        lease_seconds (float): time without a heartbeat after which a lease is stale. Defaults to 120.
+        heartbeat_seconds (float, optional): time between heartbeats. Defaults to a quarter of lease_seconds.
+        poll_seconds (float): wait between claims when every pending video is leased. Defaults to 10.
+        exit_when_done (bool): return when every video has a result, otherwise keep waiting for new
+            videos. Defaults to True.
+
+    Returns:
+        list: the names of the videos processed by this worker
+    """
+    queue = WorkQueue(queue_dir, worker_id=worker_id, lease_seconds=lease_seconds)
+    heartbeat_seconds = heartbeat_seconds or lease_seconds / 4
+    processed = []
+    while True:
+        lease = queue.claim()
+        if lease is None:
+            if exit_when_done and len(queue.pending()) == 0:
+                logger.info(f"{queue.worker_id} found no more videos, processed {len(processed)}")
+                return processed
+            # The pending videos are all leased, wait for them to finish or for a lease to expire
+            time.sleep(poll_seconds)
+            continue
+
+        lease.start_heartbeat(heartbeat_seconds)
+        # Outputs go to a folder only this claim uses, and are moved into place when published
+        output_dir = os.path.join(queue.results_dir, f".{os.path.splitext(lease.video_name)[0]}.{lease.token}")
+        os.makedirs(output_dir)
+        result = {"video": lease.video_name, "worker": queue.worker_id, "started_at": time.time()}
+        start = time.perf_counter()
+        try:
+            result["metrics"] = process_video(lease.video_path, output_dir)
+            result["status"] = "done"
+        except Exception as e:
+            logger.exception(f"{queue.worker_id} failed on {lease.video_name}")
+            result["status"] = "failed"
+            result["error"] = repr(e)
+        result["seconds"] = time.perf_counter() - start
+        if lease.lost:
+            # Another worker took the video over, its result wins
+            logger.warning(f"{queue.worker_id} not publishing {lease.video_name}, the lease was lost")
+            shutil.rmtree(output_dir, ignore_errors=True)
+        else:
+            queue.publish(lease.video_name, result, output_dir)
+            processed.append(lease.video_name)
+        lease.release()
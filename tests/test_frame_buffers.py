@@ -0,0 +1,32 @@
+import numpy as np
+from bookhighlighter.frame_buffers import FrameBufferPool
+
+#poetry run pytest
+
+
+def test_frame_pool_reuses_buffers():
+
+    pool = FrameBufferPool(100, 200, scale=0.2)
+    rng = np.random.default_rng(0)
+    first = rng.integers(0, 255, (100, 200, 3), dtype=np.uint8)
+    second = rng.integers(0, 255, (100, 200, 3), dtype=np.uint8)
+    buffers = {id(pool.grey), id(pool.small), id(pool.small_old)}
+
+    grey_first, small_first = pool.convert(first)
+    small_first_copy = small_first.copy()
+    grey_second, small_second = pool.convert(second)
+
+    assert grey_first is grey_second
+    assert small_second.shape == (20, 40)
+    # The previous small frame is kept, not overwritten
+    assert pool.small_old is small_first
+    assert np.array_equal(pool.small_old, small_first_copy)
+    assert {id(pool.grey), id(pool.small), id(pool.small_old)} == buffers
+
+def test_page_image_is_a_copy():
+
+    pool = FrameBufferPool(100, 200)
+    pool.convert(np.zeros((100, 200, 3), dtype=np.uint8))
+    page = pool.page_image()
+    pool.convert(np.full((100, 200, 3), 255, dtype=np.uint8))
+    assert np.array(page).max() == 0
@@ -1,6 +1,6 @@
 import pytest
 import numpy as np
-from bookhighlighter.functions import word_search, create_start_end_times, compare_words_in_test
+from bookhighlighter.functions import word_search, create_start_end_times, compare_words_in_test, find_silence_split_points, merge_chunk_transcriptions, transcription_clean, full_page_ocr_accepted
 from loguru import logger
 
 #poetry run python -m unittest tests/test_functions.py 
@@ -53,3 +53,94 @@ def test_transcription_longer_than_ocr_match():
     start_times, end_times = create_start_end_times(transcribed_words)
     t_words_track, ocr_words_track = compare_words_in_test(transcribed_words,ocr_words, start_times, end_times)
     assert t_words_track == ocr_words_track
+
+def test_silence_split_points():
+
+    sample_rate = 1000
+    audio = np.ones(sample_rate * 100, dtype=np.float32)
+    audio[sample_rate * 37:sample_rate * 38] = 0
+    audio[sample_rate * 80:sample_rate * 81] = 0
+    chunks = find_silence_split_points(audio, sample_rate, max_chunk_seconds=45)
+    assert chunks[0][0] == 0 and chunks[-1][1] == len(audio)
+    assert all(end - start <= sample_rate * 45 for start, end in chunks)
+    assert [start for start, _ in chunks[1:]] == [37010, 80010]
+
+def test_merge_chunk_transcriptions():
+
+    chunk = {'text': ' bear has', 'language': 'en', 'segments': [{'id': 0, 'start': 1.0, 'end': 2.0, 'text': ' bear has',
+             'words': [{'word': ' bear', 'start': 1.0, 'end': 1.5}, {'word': ' has', 'start': 1.5, 'end': 2.0}]}]}
+    merged = merge_chunk_transcriptions([chunk, chunk], [0, 30.0])
+    transcribed_words, start_times, end_times = transcription_clean(merged)
+    assert transcribed_words == ['bear', 'has', 'bear', 'has']
+    assert list(start_times) == [1.0, 1.5, 31.0, 31.5]
+    assert list(end_times) == [1.5, 2.0, 31.5, 32.0]
+
+def test_full_page_ocr_accepted():
+
+    data = {'text': ['bear', 'has', 'blown', 'up'], 'conf': [96.0, 93.0, 95.0, 91.0], 'line_starts': [100, 120]}
+    assert full_page_ocr_accepted(data, image_width=1000)[0]
+    low_conf = dict(data, conf=[96.0, 30.0, 40.0, 91.0])
+    assert not full_page_ocr_accepted(low_conf, image_width=1000)[0]
+    two_pages = dict(data, line_starts=[100, 600])
+    assert not full_page_ocr_accepted(two_pages, image_width=1000)[0]
+
+def test_extract_text_concurrent_keeps_reading_order(monkeypatch):
+
+    import os
+    import time
+    from PIL import Image
+    from bookhighlighter import functions
+
+    #Three line boxes, top to bottom.  The first one takes the longest to OCR
+    paddle_result = [[[[10, y], [50, y], [50, y + 5], [10, y + 5]] for y in (0, 20, 40)]]
+    thread_limits = []
+    def fake_ocr_region(image, b_box, *args):
+        thread_limits.append(os.environ.get('OMP_THREAD_LIMIT'))
+        time.sleep(0.05 * (2 - b_box['y0'] / 20))
+        return {'text': [str(b_box['y0'])], 'left': [b_box['x0']], 'top': [b_box['y0']], 'right': [b_box['x1']], 'bottom': [b_box['y1']]}
+    monkeypatch.setattr(functions, 'get_bounding_boxes_paddle', lambda image: paddle_result)
+    monkeypatch.setattr(functions, 'ocr_region', fake_ocr_region)
+    monkeypatch.delenv('OMP_THREAD_LIMIT', raising=False)
+    executor = functions.create_ocr_executor(3, cpu_budget=3)
+    output = functions.extract_text(Image.new('L', (100, 60)), executor=executor)
+    executor.shutdown()
+    assert output['text'] == ['0', '20', '40']
+    #The limit only applies to the tesseract calls
+    assert thread_limits == ['1', '1', '1']
+    assert 'OMP_THREAD_LIMIT' not in os.environ
+    assert functions.create_ocr_executor(1, cpu_budget=3) is None
+    assert 'OMP_THREAD_LIMIT' not in os.environ
+
+def test_ocr_savings_reported_per_page():
+
+    from bookhighlighter.functions import estimate_ocr_saving, summarize_ocr_reports
+
+    reports = []
+    for report in [{'path': 'two_stage', 'full_page_seconds': 0.5, 'two_stage_seconds': 3.0},
+                   {'path': 'full_page', 'full_page_seconds': 1.0}]:
+        reports.append(estimate_ocr_saving(report, reports))
+    assert [x['saved_seconds'] for x in reports] == [0.0, 2.0]
+    assert 'about 2.0s saved' in summarize_ocr_reports(reports)
+    unknown = [estimate_ocr_saving({'path': 'full_page', 'full_page_seconds': 0.5}, [])]
+    assert unknown[0]['saved_seconds'] is None
+    assert 'unknown' in summarize_ocr_reports(unknown)
+
+def test_cascade_skips_paddle_when_every_page_passes(monkeypatch):
+
+    from PIL import Image
+    from bookhighlighter import functions
+
+    full_page = {'text': ['bear', 'has', 'blown', 'up'], 'conf': [96.0, 93.0, 95.0, 91.0], 'line_starts': [100, 120],
+                 'left': [100, 200, 300, 120], 'top': [10, 10, 10, 40], 'right': [150, 250, 350, 170], 'bottom': [30, 30, 30, 60]}
+    def fail(*args, **kwargs):
+        raise AssertionError('PaddleOCR should not be used')
+    monkeypatch.setattr(functions, 'extract_text_full_page', lambda image, psm=3: dict(full_page))
+    monkeypatch.setattr(functions, 'get_paddle_ocr', fail)
+    monkeypatch.setattr(functions, 'get_bounding_boxes_paddle', fail)
+    reports = []
+    for _ in range(3):
+        output, report = functions.ocr_page(Image.new('L', (1000, 200)), 'cascade')
+        reports.append(functions.estimate_ocr_saving(report, reports))
+    assert output['text'] == full_page['text']
+    assert all(x['path'] == 'full_page' and x['saved_seconds'] is None for x in reports)
+    assert 'unknown' in functions.summarize_ocr_reports(reports)
@@ -0,0 +1,60 @@
+import queue
+import pytest
+import numpy as np
+from skimage.metrics import structural_similarity as ssim
+from bookhighlighter.page_detection import CachedSSIMDetector, FrameDiffDetector, PageTracker, ScdetDetector
+from loguru import logger
+
+#poetry run pytest
+
+
+@pytest.fixture(autouse=True)
+def setup():
+    logger.disable('bookhighlighter')
+
+def make_frames():
+    rng = np.random.default_rng(0)
+    first = rng.integers(0, 255, (108, 192), dtype=np.uint8)
+    second = first.copy()
+    second[20:60, 30:120] = rng.integers(0, 255, (40, 90), dtype=np.uint8)
+    return first, second
+
+def test_cached_ssim_matches_skimage():
+
+    first, second = make_frames()
+    detector = CachedSSIMDetector()
+    assert detector.update(first) == 1.0
+    assert detector.update(second) == pytest.approx(ssim(first, second))
+    assert detector.update(first) == pytest.approx(ssim(second, first))
+
+def test_frame_diff_still_page():
+
+    first, second = make_frames()
+    detector = FrameDiffDetector()
+    detector.update(first)
+    assert detector.update(first) == 1.0
+    assert detector.update(second) < 1.0
+
+def test_page_tracker_new_page():
+
+    page_tracker = PageTracker(unstable_threshold=0.85, stable_threshold=0.95, window=5)
+    scores = [1.0, 1.0, 0.5, 0.9, 0.97, 0.97, 0.97, 0.97, 0.97, 1.0]
+    new_pages = [page_tracker.update(x) for x in scores]
+    assert new_pages == [False] * 8 + [True, False]
+
+def test_scdet_stays_in_step_with_frame_step():
+
+    #Skip starting ffmpeg, and feed the detector the scores it would read
+    detector = ScdetDetector.__new__(ScdetDetector)
+    detector.timeout = 1
+    detector.frame_step = 3
+    detector.updates = 0
+    detector.scores = queue.Queue()
+    for score in [0, 1, 2, 40, 0, 0, 0, 5, None]:
+        detector.scores.put(score)
+    # Frame 0, then frames 1-3, 4-6, and the last frame before the end of the video
+    assert detector.update() == 1.0
+    assert detector.update() == pytest.approx(0.6)
+    assert detector.update() == 1.0
+    assert detector.update() == pytest.approx(0.95)
+    assert detector.update() == 1.0
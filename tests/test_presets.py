@@ -0,0 +1,36 @@
+import json
+import pytest
+from bookhighlighter.presets import PRESETS, load_settings
+from loguru import logger
+
+#poetry run pytest
+
+
+@pytest.fixture(autouse=True)
+def setup():
+    logger.disable('bookhighlighter')
+
+def test_presets_have_the_same_settings():
+
+    keys = [set(x) for x in PRESETS.values()]
+    assert all(x == keys[0] for x in keys)
+
+def test_settings_precedence(tmp_path):
+
+    config_file = tmp_path / 'config.json'
+    config_file.write_text(json.dumps({'preset': 'fast', 'whisper_model': 'small'}))
+    settings = load_settings(config_file=str(config_file), overrides={'ocr_workers': 2, 'page_detector': None})
+    assert settings['preset'] == 'fast'
+    assert settings['whisper_model'] == 'small'
+    assert settings['ocr_workers'] == 2
+    assert settings['page_detector'] == PRESETS['fast']['page_detector']
+    assert load_settings('accurate', str(config_file))['preset'] == 'accurate'
+    assert load_settings()['whisper_model'] == 'medium'
+    assert load_settings()['page_detector'] == 'ssim_cached'
+
+def test_unknown_setting(tmp_path):
+
+    config_file = tmp_path / 'config.json'
+    config_file.write_text(json.dumps({'whisper_modle': 'small'}))
+    with pytest.raises(ValueError):
+        load_settings(config_file=str(config_file))
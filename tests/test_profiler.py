@@ -0,0 +1,33 @@
+import pytest
+from bookhighlighter.profiler import start_profiler, stop_profiler, set_stage
+from loguru import logger
+
+#poetry run pytest
+
+
+@pytest.fixture(autouse=True)
+def setup():
+    logger.disable('bookhighlighter')
+
+def busy_loop(iterations):
+    total = 0
+    for i in range(iterations):
+        total = total + i * i
+    return total
+
+def test_profiler_tags_stages(tmp_path):
+
+    start_profiler(interval=0.001, max_overhead=0.5)
+    set_stage('ocr', 3)
+    busy_loop(2_000_000)
+    profiler = stop_profiler()
+    set_stage('ignored')
+
+    assert profiler.stage_counts['ocr'] > 0
+    assert 'ignored' not in profiler.stage_counts
+    collapsed_file = tmp_path / 'profile.collapsed'
+    profiler.write_collapsed(collapsed_file)
+    lines = collapsed_file.read_text().splitlines()
+    assert any(line.startswith('ocr;page 3;') and 'busy_loop' in line for line in lines)
+    assert all(int(line.rsplit(' ', 1)[1]) > 0 for line in lines)
+    assert 'busy_loop' in profiler.summary(top_n=3)
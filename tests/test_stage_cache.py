@@ -0,0 +1,92 @@
+import os
+import pytest
+from bookhighlighter.stage_cache import StageCache, code_version
+from loguru import logger
+
+#poetry run pytest
+
+
+@pytest.fixture(autouse=True)
+def setup():
+    logger.disable('bookhighlighter')
+
+def test_key_is_stable(tmp_path):
+
+    cache = StageCache(str(tmp_path))
+    key = cache.key('render', {'padding': 5, 'color': [0, 255, 0]}, ['a', 'b'])
+    assert key == cache.key('render', {'color': [0, 255, 0], 'padding': 5}, ['a', 'b'])
+    assert key != cache.key('render', {'color': [0, 255, 0], 'padding': 6}, ['a', 'b'])
+    assert key != cache.key('render', {'color': [0, 255, 0], 'padding': 5}, ['a', 'c'])
+    assert key != cache.key('mux', {'color': [0, 255, 0], 'padding': 5}, ['a', 'b'])
+
+def test_stage_reruns_only_when_params_change(tmp_path):
+
+    cache = StageCache(str(tmp_path))
+    calls = []
+    def compute():
+        calls.append(1)
+        return {'pages': [0, 10]}
+
+    key, value = cache.run('page_spans', {'detector': 'ssim'}, ['file:abc'], compute)
+    assert value == {'pages': [0, 10]}
+    assert cache.run('page_spans', {'detector': 'ssim'}, ['file:abc'], compute) == (key, value)
+    assert len(calls) == 1
+    cache.run('page_spans', {'detector': 'scdet'}, ['file:abc'], compute)
+    assert len(calls) == 2
+    StageCache(str(tmp_path), enabled=False).run('page_spans', {'detector': 'ssim'}, ['file:abc'], compute)
+    assert len(calls) == 3
+
+def test_file_stage(tmp_path):
+
+    cache = StageCache(str(tmp_path))
+    calls = []
+    def compute(output_path):
+        calls.append(output_path)
+        with open(output_path, 'w') as file:
+            file.write('video')
+
+    key, path = cache.run('render', {}, ['x'], compute, file_name='highlighted.mp4')
+    assert open(path).read() == 'video'
+    assert os.path.dirname(calls[0]) != os.path.dirname(path)
+    assert cache.run('render', {}, ['x'], compute, file_name='highlighted.mp4') == (key, path)
+    assert len(calls) == 1
+    assert not any(x.endswith('.partial') for x in os.listdir(tmp_path / 'render'))
+
+def test_file_stage_first_writer_wins(tmp_path):
+
+    cache = StageCache(str(tmp_path))
+    key = cache.key('render', {}, ['x'])
+    def write(output_path, text):
+        with open(output_path, 'w') as file:
+            file.write(text)
+    def compute(output_path):
+        #Another process stores the same key while this one computes it
+        os.makedirs(tmp_path / 'render' / key)
+        write(tmp_path / 'render' / key / 'highlighted.mp4', 'first')
+        write(output_path, 'second')
+
+    _, path = cache.run('render', {}, ['x'], compute, file_name='highlighted.mp4')
+    assert open(path).read() == 'first'
+    assert os.listdir(tmp_path / 'render') == [key]
+    #A run with the cache disabled computes the output again, but doesn't replace the stored one
+    _, path = StageCache(str(tmp_path), enabled=False).run('render', {}, ['x'], lambda output_path: write(output_path, 'third'), file_name='highlighted.mp4')
+    assert open(path).read() == 'first'
+    assert os.listdir(tmp_path / 'render') == [key]
+
+def test_file_key_follows_content(tmp_path):
+
+    cache = StageCache(str(tmp_path / 'cache'))
+    video = tmp_path / 'book.mp4'
+    video.write_bytes(b'frames')
+    key = cache.file_key(str(video))
+    assert key == cache.file_key(str(video))
+    copy = tmp_path / 'copy.mp4'
+    copy.write_bytes(b'frames')
+    assert cache.file_key(str(copy)) == key
+    video.write_bytes(b'other frames')
+    assert cache.file_key(str(video)) != key
+
+def test_code_version():
+
+    assert code_version(test_code_version) == code_version(test_code_version)
+    assert code_version(test_code_version) != code_version(test_file_key_follows_content)
@@ -0,0 +1,25 @@
+import subprocess
+import sys
+import os
+
+#poetry run pytest
+
+# Importing the functions used by word_search should only pull in numpy and loguru
+IMPORT_BUDGET_SECONDS = 1.5
+HEAVY_MODULES = ['whisper', 'torch', 'paddle', 'paddleocr', 'skimage', 'pytesseract', 'cv2']
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_functions_import_time():
+
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "from bookhighlighter.functions import word_search\n"
+        "print(time.perf_counter() - start)\n"
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))\n"
+    )
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, cwd=REPO_ROOT, check=True)
+    import_seconds, heavy_modules = result.stdout.splitlines()
+    assert heavy_modules == ''
+    assert float(import_seconds) < IMPORT_BUDGET_SECONDS
@@ -0,0 +1,100 @@
+import json
+import multiprocessing
+import os
+import time
+import pytest
+from bookhighlighter.work_queue import WorkQueue, run_worker
+from loguru import logger
+
+#poetry run pytest
+
+
+@pytest.fixture(autouse=True)
+def setup():
+    logger.disable('bookhighlighter')
+
+def record_video(video_path, output_dir):
+    time.sleep(0.05)
+    name = os.path.basename(video_path)
+    with open(os.path.join(os.path.dirname(os.path.dirname(video_path)), 'processed.log'), 'a') as file:
+        file.write(name + '\n')
+    with open(os.path.join(output_dir, name + '.out'), 'w') as file:
+        file.write('highlighted')
+    return {'frames': 10}
+
+def make_queue(queue_dir, num_videos):
+    queue = WorkQueue(str(queue_dir))
+    video_names = [f'book_{i}.mp4' for i in range(num_videos)]
+    for name in video_names:
+        with open(os.path.join(queue.videos_dir, name), 'w') as file:
+            file.write('video')
+    return queue, video_names
+
+def test_workers_process_each_video_once(tmp_path):
+
+    queue, video_names = make_queue(tmp_path, 8)
+    workers = [
+        multiprocessing.Process(target=run_worker, args=(str(tmp_path), record_video),
+                                kwargs={'worker_id': f'worker_{i}', 'lease_seconds': 5, 'poll_seconds': 0.1})
+        for i in range(3)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=60)
+        assert worker.exitcode == 0
+
+    processed = (tmp_path / 'processed.log').read_text().split()
+    assert sorted(processed) == video_names
+    assert queue.pending() == []
+    assert os.listdir(queue.leases_dir) == []
+    for name in video_names:
+        result = json.loads((tmp_path / 'results' / f'{name}.json').read_text())
+        assert result['status'] == 'done'
+        assert result['metrics'] == {'frames': 10}
+        assert result['outputs'] == [f'{name}.out']
+
+def test_stale_lease_is_reclaimed(tmp_path):
+
+    queue, video_names = make_queue(tmp_path, 1)
+    lease_path = queue.lease_path(video_names[0])
+    with open(lease_path, 'w') as file:
+        json.dump({'worker': 'crashed_worker', 'token': 'abc'}, file)
+    old_time = time.time() - 60
+    os.utime(lease_path, (old_time, old_time))
+
+    processed = run_worker(str(tmp_path), record_video, worker_id='worker', lease_seconds=5, poll_seconds=0.1)
+    assert processed == video_names
+    assert queue.pending() == []
+
+def test_fresh_lease_is_not_claimed(tmp_path):
+
+    queue, video_names = make_queue(tmp_path, 1)
+    with open(queue.lease_path(video_names[0]), 'w') as file:
+        json.dump({'worker': 'busy_worker', 'token': 'abc'}, file)
+    assert queue.claim() is None
+
+def test_lease_lost_during_heartbeat_is_not_published(tmp_path, monkeypatch):
+
+    queue, video_names = make_queue(tmp_path, 1)
+    calls = []
+    utime = os.utime
+    def break_lease_on_first_run(path, *args, **kwargs):
+        #The lease is removed between the heartbeat reading it and touching it
+        if len(calls) == 1 and path.endswith('.lease'):
+            raise FileNotFoundError(path)
+        return utime(path, *args, **kwargs)
+    def process_video(video_path, output_dir):
+        calls.append(video_path)
+        time.sleep(0.3)
+        return {'run': len(calls)}
+    monkeypatch.setattr(os, 'utime', break_lease_on_first_run)
+
+    # The lost claim isn't published, so the video is claimed and processed again
+    processed = run_worker(str(tmp_path), process_video, worker_id='worker', lease_seconds=5,
+                           heartbeat_seconds=0.05, poll_seconds=0.1)
+    assert processed == video_names
+    assert len(calls) == 2
+    result = json.loads((tmp_path / 'results' / f'{video_names[0]}.json').read_text())
+    assert result['metrics'] == {'run': 2}
+    assert [x for x in os.listdir(queue.results_dir) if x.startswith('.')] == []